@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+
+'''
+Benchmarks of the calendar scraper in fetch_calendar.py.
+They run on synthetic or recorded data only, no network access is needed.
+
+Usage:
+
+    python3 data/bench_calendar.py consolidate
+    python3 data/bench_calendar.py parse
+    python3 data/bench_calendar.py pipeline --latency 0.05 --error-rate 0.01
+    python3 data/bench_calendar.py --check
+
+With --check the run fails (exit status 1) when a benchmark regresses past
+the thresholds below. They compare the code with itself (scaling with the
+horizon, speedup over the reference parser, identical output at every
+concurrency setting), so they do not depend on the speed of the machine.
+'''
+
+from argparse import ArgumentParser
+from base64 import b64decode
+import calendar
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from lxml.html import fragment_fromstring, tostring
+from lzma import decompress
+from pathlib import Path
+from random import Random
+import sys
+from requests.adapters import HTTPAdapter
+from tempfile import TemporaryDirectory
+from threading import Lock, Thread
+from time import perf_counter, sleep
+import tracemalloc
+from urllib.parse import parse_qs, urlsplit
+
+import fetch_calendar
+from fetch_calendar import (
+    build_calendar, consolidate_multiday_events, parse_month_days, sample_response,
+    transform_to_json, write_file_atomically)
+
+# --check thresholds: max growth of the consolidation time per day from the shortest
+# to the longest horizon (it is linear, so about 1), and min speedup of parse_month_days()
+# over parse_month_days_reference()
+CONSOLIDATE_MAX_GROWTH = 3
+PARSE_MIN_SPEEDUP = 1.2
+
+
+def main():
+    p = ArgumentParser()
+    p.add_argument('benchmark', nargs='*', help=f'Benchmarks to run: {", ".join(sorted(benchmarks))} (default: all)')
+    p.add_argument('--latency', type=float, default=0.02, help='Replay server latency per request in seconds (pipeline benchmark, default: 0.02)')
+    p.add_argument('--error-rate', type=float, default=0, help='Fraction of replay server responses that fail with HTTP 503 (pipeline benchmark, default: 0)')
+    p.add_argument('--check', action='store_true', help='Exit with status 1 if a benchmark regressed past its threshold')
+    args = p.parse_args()
+    options = {
+        'pipeline': {'latency': args.latency, 'error_rate': args.error_rate},
+    }
+    # not checked with choices=, older Python versions reject the empty default list
+    for name in args.benchmark:
+        if name not in benchmarks:
+            p.error(f'Unknown benchmark {name!r}, choose from {", ".join(sorted(benchmarks))}')
+    problems = []
+    for name in args.benchmark or sorted(benchmarks):
+        print(f'== {name}')
+        result = benchmarks[name](**options.get(name, {}))
+        problems += checks[name](result)
+    if args.check:
+        for problem in problems:
+            print(f'FAIL: {problem}')
+        if problems:
+            sys.exit(1)
+        print('All benchmark checks passed')
+
+
+def check_consolidate(us_per_day):
+    growth = us_per_day[max(us_per_day)] / us_per_day[min(us_per_day)]
+    if growth > CONSOLIDATE_MAX_GROWTH:
+        return [f'consolidation time per day grew {growth:.1f}x from {min(us_per_day)} to {max(us_per_day)} years '
+                f'(max {CONSOLIDATE_MAX_GROWTH}x)']
+    return []
+
+
+def check_parse(speedup):
+    if speedup < PARSE_MIN_SPEEDUP:
+        return [f'parse_month_days() is only {speedup:.2f}x faster than the reference (min {PARSE_MIN_SPEEDUP}x)']
+    return []
+
+
+def check_pipeline(outputs):
+    problems = []
+    for month_count, results in outputs.items():
+        if any(result is None for result in results.values()):
+            problems.append(f'pipeline failed for {month_count} months')
+        elif len(set(results.values())) > 1:
+            problems.append(f'pipeline output for {month_count} months differs between job counts {sorted(results)}')
+    return problems
+
+
+def bench_consolidate(years=(1, 2, 4, 8, 16), repeat=3):
+    '''
+    Consolidate synthetic multi-year horizons and report time per day.
+    The time per day should stay roughly constant as the horizon grows.
+    Returns years -> microseconds per day.
+    '''
+    us_per_day = {}
+    print(f'{"years":>5} {"days":>6} {"events":>7} {"total ms":>9} {"us/day":>7}')
+    for year_count in years:
+        days = synthetic_days(date(2024, 1, 1), 365 * year_count)
+        event_count = sum(len(day['events']) for day in days)
+        elapsed = min(timed(consolidate_multiday_events, days) for _ in range(repeat))
+        us_per_day[year_count] = elapsed / len(days) * 1e6
+        print(f'{year_count:>5} {len(days):>6} {event_count:>7} {elapsed * 1e3:>9.1f} {us_per_day[year_count]:>7.2f}')
+    return us_per_day
+
+
+def synthetic_days(start_date, day_count, courses_per_week=6, seed=42):
+    '''
+    Generate days in the format returned by fetch_calendar.parse_month_days().
+    Courses last 1-5 days, the same course repeats many times over the horizon
+    and single-day courses are sometimes listed on several consecutive days.
+    Course durations are put into the in-process cache, so no pages are fetched.
+    '''
+    rnd = Random(seed)
+    courses = []
+    for i in range(40):
+        url = f'https://daily-adventures.cz/eshop/synthetic-course-{i}/'
+        duration = rnd.choice([1, 1, 2, 3, 5])
+        fetch_calendar._course_duration_cache[url] = duration
+        courses.append((f'Synthetic course {i}', url, duration))
+    days = [{'date': start_date + timedelta(days=n), 'events': []} for n in range(day_count)]
+    for week_start in range(0, day_count, 7):
+        for _ in range(courses_per_week):
+            title, url, duration = rnd.choice(courses)
+            listed_days = duration if duration > 1 else rnd.choice([1, 1, 2, 3])
+            first_day = week_start + rnd.randrange(7)
+            for n in range(first_day, min(first_day + listed_days, day_count)):
+                if not any(event['title'] == title for event in days[n]['events']):
+                    days[n]['events'].append({'title': title, 'url': url})
+    return days
+
+
+def bench_parse(duration=1.0):
+    '''
+    Parse the embedded sample_response repeatedly and report table cells parsed per second,
+    before (reference implementation below) and after the optimizations of parse_month_days().
+    Returns the speedup.
+    '''
+    month_html = decompress(b64decode(sample_response.strip())).decode('utf-8')
+    month_date = date(2024, 3, 1)
+    cell_count = len(fragment_fromstring(month_html).xpath('./tr/td'))
+    assert parse_month_days(month_html, month_date) == parse_month_days_reference(month_html, month_date)
+    results = {}
+    for name, parse in ('before', parse_month_days_reference), ('after', parse_month_days):
+        iterations = 0
+        t0 = perf_counter()
+        while perf_counter() - t0 < duration:
+            parse(month_html, month_date)
+            iterations += 1
+        results[name] = cell_count * iterations / (perf_counter() - t0)
+        print(f'{name:>6}: {results[name]:>10,.0f} cells/s')
+    speedup = results['after'] / results['before']
+    print(f'speedup: {speedup:.2f}x')
+    return speedup
+
+
+def parse_month_days_reference(data, month_date):
+    '''
+    The original implementation of parse_month_days(): it serializes every cell
+    for a possible error message and evaluates XPath strings in the loop.
+    '''
+    logger = fetch_calendar.logger
+    tbody = fragment_fromstring(data)
+    previous_day = None
+    result_days = []
+    for tr in tbody.xpath('./tr'):
+        for td in tr.xpath('./td'):
+            td_html = tostring(td, encoding='utf-8').decode('utf-8')
+            try:
+                td_classes = td.attrib['class'].split()
+                if 'simcal-day-void' in td_classes:
+                    continue
+                assert 'simcal-day' in td_classes
+                day = None
+                for class_name in td_classes:
+                    if class_name.startswith('simcal-day-'):
+                        day = int(class_name[len('simcal-day-'):])
+                        break
+                assert day
+                if previous_day is not None:
+                    assert day == previous_day + 1
+                previous_day = day
+                day_date = month_date.replace(day=day)
+                result_day = {
+                    'date': day_date,
+                    'events': [],
+                }
+                result_days.append(result_day)
+                logger.debug('day: %s day_date: %s', day, day_date)
+                li_events = td.xpath('.//ul[@class="simcal-events"]/li')
+                assert bool(li_events) == ('simcal-day-has-events' in td_classes)
+                for li_event in li_events:
+                    li_event_classes = li_event.attrib['class'].split()
+                    assert 'simcal-event' in li_event_classes
+                    span_title = li_event.xpath('.//span[@class="simcal-event-title"]')[0]
+                    title = span_title.text_content()
+                    logger.debug('  title: %r', title)
+                    urls = []
+                    preferred_url = None
+                    for a in li_event.xpath('.//a'):
+                        logger.debug('  a: %r -> %r', a.text_content(), a.attrib['href'])
+                        urls.append(a.attrib['href'])
+                        if 'daily-adventures.cz' in a.attrib['href']:
+                            preferred_url = a.attrib['href']
+                    if not preferred_url and urls:
+                        preferred_url = urls[0]
+                    result_day['events'].append({
+                        'title': title,
+                        'url': preferred_url,
+                    })
+            except Exception as e:
+                raise Exception(f'Failed to parse {td_html.strip()}: {e}') from e
+    return result_days
+
+
+def bench_pipeline(horizons=(3, 6, 12), jobs=(1, 4, 8), latency=0.02, error_rate=0):
+    '''
+    Run the whole pipeline (retrieve, parse, consolidate, transform_to_json, dump)
+    against the local replay server for a sweep of horizon lengths and concurrency
+    settings. Reports wall time, requests served and peak Python memory.
+    Returns months -> job count -> output JSON (None if the run failed).
+    '''
+    outputs = {}
+    print(f'latency {latency * 1e3:.0f} ms, error rate {error_rate:.1%}')
+    print(f'{"months":>6} {"jobs":>4} {"wall s":>7} {"months rq":>9} {"course rq":>9} {"errors":>6} {"peak MiB":>8}  result')
+    with ReplayServer(latency=latency, error_rate=error_rate) as server, TemporaryDirectory() as temp_dir:
+        for month_count in horizons:
+            month_dates = [date(2024, 3, 1)]
+            while len(month_dates) < month_count:
+                month_dates.append(fetch_calendar.next_month(month_dates[-1]))
+            outputs[month_count] = {}
+            for job_count in jobs:
+                fetch_calendar._course_duration_cache.clear()
+                fetch_calendar._course_cache_entries.clear()
+                server.counts.clear()
+                tracemalloc.start()
+                t0 = perf_counter()
+                try:
+                    output = build_calendar(month_dates, jobs=job_count, course_jobs=job_count, per_host=job_count)
+                    output_json = json.dumps(transform_to_json(output), indent=2)
+                    write_file_atomically(Path(temp_dir) / 'calendar.json', output_json + '\n')
+                    result = f'{len(output_json):,} bytes'
+                    outputs[month_count][job_count] = output_json
+                except Exception as e:
+                    result = f'failed: {e}'
+                    outputs[month_count][job_count] = None
+                elapsed = perf_counter() - t0
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(
+                    f'{month_count:>6} {job_count:>4} {elapsed:>7.2f} {server.counts["month"]:>9} '
+                    f'{server.counts["course"]:>9} {server.counts["error"]:>6} {peak_memory / 2**20:>8.1f}  {result}')
+    return outputs
+
+
+class ReplayServer:
+    '''
+    Local stand-in for daily-adventures.cz serving recorded admin-ajax.php month responses
+    and course pages, with configurable latency and error injection.
+    While running, requests of fetch_calendar.rs to daily-adventures.cz are routed to it.
+    '''
+
+    site_url = 'https://daily-adventures.cz'
+
+    def __init__(self, latency=0, error_rate=0, seed=42):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.counts = Counter()
+        self._random = Random(seed)
+        self._lock = Lock()
+        self._recorded_month_html = decompress(b64decode(sample_response.strip())).decode('utf-8')
+        self._month_html_cache = {}
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), ReplayRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.replay = self
+        self.url = f'http://127.0.0.1:{self._httpd.server_address[1]}'
+
+    def __enter__(self):
+        Thread(target=self._httpd.serve_forever, daemon=True).start()
+        fetch_calendar.rs.mount(self.site_url + '/', ReplayAdapter(self.url, self.site_url, pool_maxsize=32))
+        return self
+
+    def __exit__(self, *exc_info):
+        del fetch_calendar.rs.adapters[self.site_url + '/']
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def respond(self, kind):
+        '''
+        Count the request and apply latency and error injection.
+        Returns False if the request should fail.
+        '''
+        if self.latency:
+            sleep(self.latency)
+        with self._lock:
+            self.counts[kind] += 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.counts['error'] += 1
+                return False
+        return True
+
+    def month_html(self, year, month):
+        key = (year, month)
+        with self._lock:
+            if key not in self._month_html_cache:
+                self._month_html_cache[key] = synthesize_month_html(self._recorded_month_html, date(year, month, 1))
+            return self._month_html_cache[key]
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        data = {k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()}
+        if urlsplit(self.path).path != '/wp-admin/admin-ajax.php' or data.get('action') != 'simcal_default_calendar_draw_grid':
+            self.send_error(404)
+            return
+        if not self.server.replay.respond('month'):
+            self.send_error(503)
+            return
+        month_html = self.server.replay.month_html(int(data['year']), int(data['month']))
+        self._send(200, 'application/json', json.dumps({'success': True, 'data': month_html}))
+
+    def do_GET(self):
+        slug = urlsplit(self.path).path.strip('/').split('/')[-1]
+        if slug not in recorded_course_pages:
+            self.send_error(404)
+            return
+        if not self.server.replay.respond('course'):
+            self.send_error(503)
+            return
+        page_html = decompress(b64decode(recorded_course_pages[slug])).decode('utf-8')
+        self._send(200, 'text/html; charset=UTF-8', page_html)
+
+    def _send(self, status, content_type, content):
+        content = content.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplayAdapter(HTTPAdapter):
+    '''
+    Transport adapter that sends requests for `site_url` to the replay server instead.
+    '''
+
+    def __init__(self, replay_url, site_url, **kwargs):
+        super().__init__(**kwargs)
+        self.replay_url = replay_url
+        self.site_url = site_url
+
+    def send(self, request, **kwargs):
+        request.url = self.replay_url + request.url[len(self.site_url):]
+        return super().send(request, **kwargs)
+
+
+def synthesize_month_html(recorded_html, month_date):
+    '''
+    Build the admin-ajax.php calendar grid HTML for `month_date` from a recorded month:
+    day N of the new month gets the events of day N of the recorded month.
+    '''
+    day_cells = {}
+    for td in fragment_fromstring(recorded_html).xpath('./tr/td'):
+        classes = td.attrib['class'].split()
+        if 'simcal-day-void' not in classes:
+            day = next(int(c[len('simcal-day-'):]) for c in classes if c[len('simcal-day-'):].isdigit())
+            day_cells[day] = tostring(td, encoding='unicode', with_tail=False)
+    day_count = calendar.monthrange(month_date.year, month_date.month)[1]
+    cells = ['<td class="simcal-day simcal-day-void "></td>'] * month_date.weekday()
+    cells += [day_cells[day] for day in range(1, day_count + 1)]
+    cells += ['<td class="simcal-day simcal-day-void "></td>'] * (-len(cells) % 7)
+    rows = [''.join(cells[i:i + 7]) for i in range(0, len(cells), 7)]
+    return (
+        f'<tbody class="simcal-month simcal-month-{month_date.month}">' +
+        ''.join(f'<tr class="simcal-week">{row}</tr>' for row in rows) +
+        '</tbody>')
+
+
+def timed(f, *args):
+    t0 = perf_counter()
+    f(*args)
+    return perf_counter() - t0
+
+
+benchmarks = {
+    'consolidate': bench_consolidate,
+    'parse': bench_parse,
+    'pipeline': bench_pipeline,
+}
+
+checks = {
+    'consolidate': check_consolidate,
+    'parse': check_parse,
+    'pipeline': check_pipeline,
+}
+
+
+# Course pages of the events in sample_response (lzma + base64, like sample_response)
+recorded_course_pages = {
+    'lavinovy-kurz-pro-zacatecniky-jeseniky': '''
+/Td6WFoAAATm1rRGAgAhARYAAAB0L+Wj4Aa9AYVdAB4IRQbQ76goF1nZqfXqpyU+xWwD3ECuMSj6/vByrRoNIqJwGJ7ZfhwxUntg1PUzcA8wgi
+4wuSBGh9Dlhq1fdbe9+MFWJt6+C0+Mg+I5BTXdj3DmTPc1HOUAWl82c3c7g4rR9ahd91XlTjn4+gK/QJzu9LnJIwdNAjRdSqgUIwJl8yyinUby
+HDd2BHeq/jLHeQ+/u3m2dAtDUDNYPKcMxj4l6qHN+d5eSTUj11uVBSIVOYRdua646uM7w+2QEhszEcXWBsHTD5FRbMfKNG2re14xd1fzQtK0l0
+/huZchB9/EhZB1b19fiaaYVmfqKOEIE+mQe5LJ6ugxo70hhfmZR6Z82YAz3pGW9US/RofT36GPPRXCOgt3Zf4Jre5/UiLcB98fBqF70kOHnlVg
+dXQfAsOb1dE3LlF4T6a1+HqbyRHKqipdkmX2AZLzpS0uG7/gKaABoo6hL7xiDZ1ki1JfGOIdIKZ41rm00+uXpemWWZXpWBhDD6tP5ln1T4Tnw4
+kCNeIgp7bDAAAAAK4HFwsFeusfAAGhA74NAAC8xsCjscRn+wIAAAAABFla
+''',
+    'skialpovy-kurz-pro-zacatecniky-jeseniky': '''
+/Td6WFoAAATm1rRGAgAhARYAAAB0L+Wj4AbnAYZdAB4IRQbQ76goF1nZqfXqpyU+xWwD3ECuMSj6/vByrRoNIqJwGJ7ZfhwxUntg1PUzcA8wgi
+4wuSBGh9Dlhq1fdbe+BYvO/vfyd9gR2GcUWigjx6GauroBz8+1BuO40Ic+4plr9yKTZ6zhOhYBW5WSfLItkana/saEYprWK2IVz3ALSqMprCwv
+LwrgkItReN0Mtae4vrOc+viAFIFzR4NSewbAokrxcNRvQuecsih7dp1nNJgBOPRe6T6AVYJnoAfsEOg0kZpvKw3sBTBDD2kEDS1uma3oW1ZpW7
+pFhEWvvsBdvclr1wfT+JRDTukP3tVRRHrhVl6+Op8h4k2BWiWBnCfXC8HjQIbugkj1sIM4ytyFLau3hu33Bqa0yKrSQHCVxNP8WWpSKcz2gHDZ
+qPhESseI/QVAqy52sAR66TsUNiHc0rsJg127019SaJadNYE3XDvilOuBG/VG5bGC9FZdYfJe3ybrcsTE4iZR8p2G/i5IH33NAVsfT2sDVvGE6x
+jfNIJv3B3hIAAAAPRe4gjdENAKAAGiA+gNAABs5DLLscRn+wIAAAAABFla
+''',
+    'zakladni-kurz-lezeni-na-umele-stene': '''
+/Td6WFoAAATm1rRGAgAhARYAAAB0L+Wj4AcDAaJdAB4IRQbQ76goF1nZqfXqpyU+xWwD3ECuMSj6/vByrRoNIqJwGJ7ZfhwxUntg1PUzcA8wgi
+4wuSBGh9Dlhq1fdbe99yewDoC4PsrfRRtd9Q5Gx6RaLbhXeCsrvSsuLHt7HzBSa2SX2c7QJLcvxxCpsLbO2w5ROEJyAKmYLGQjfXgBEy/Unk4l
+epMJ0WuA/GI/XFsOMMFYPe7QEoQVgr4d9XDNv91RgIwer2XuCpf8cS9jAi0cVXNU+fnHyIZ3SZGTVgTl5Cc2VQVqfX8cw372Ak1PT1fB3XiemV
++zrvMyAfRgBlP5g/WGMwZ65ylhwR9aDtX/uOenF8dvI1Jq393U76zsAwYnj/FehSau4w9pdLGvn069WXChXTHyCcJnGB9pxarIvP6R5ezvZvs1
+k1u4qYnvKlgf2FiYj+Dh5B9gbIwHtmzNpbCdPZCoTCr1P9jjxYAe51g0Xfng3ggjSsQKH7J0pFgatwEvaNiQ9XR/OSCqKHxdKYTOOZe3En6tck
+PuxqgzOqhcgOzi9nNnMhF1Apwa08zALyxLSnWx9+bENhl/dAAAAADakYx+TcjTfgABvgOEDgAAbtCQzLHEZ/sCAAAAAARZWg==
+''',
+}
+
+
+if __name__ == '__main__':
+    main()
@@ -22,17 +22,37 @@ curl 'https://daily-adventures.cz/wp-admin/admin-ajax.php' \
   --data-raw 'action=simcal_default_calendar_draw_grid&month=4&year=2024&id=12100'
 '''
 
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
 from base64 import b64decode
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager, nullcontext
 from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+import gzip
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import json
 from logging import getLogger, basicConfig, DEBUG, INFO
+from lxml.etree import XPath
 from lxml.html import fragment_fromstring, tostring, document_fromstring
 from lzma import decompress
 from pathlib import Path
+from random import uniform
 import re
+import sys
 from reprlib import repr as smart_repr
 import requests
+import requests.adapters
+from threading import BoundedSemaphore, Event, Lock, Thread
+from time import monotonic, perf_counter, sleep
+from unicodedata import combining, normalize
+from urllib.parse import urlsplit
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 logger = getLogger(__name__)
@@ -40,42 +60,1295 @@ rs = requests.Session()
 
 # Cache for course durations to avoid fetching the same page multiple times
 _course_duration_cache = {}
+# Course pages being fetched right now (url -> Future), so concurrent lookups
+# of the same URL wait for the one request in flight instead of sending another
+_course_duration_pending = {}
+_course_duration_lock = Lock()
+# Course pages that failed to be fetched in this run (retries exhausted); later lookups
+# in the run return None without fetching them again, but nothing is stored in the course cache
+_course_duration_failed = set()
+
+# Persistent course page cache (url -> {'days', 'etag', 'last_modified', 'fetched_at'}),
+# loaded by load_course_cache() and written back by save_course_cache()
+_course_cache_entries = {}
+_course_cache_ttl = timedelta(days=7)
+
+# Hosts of the scraped sources; course durations are looked up for event URLs on them
+_course_hosts = {'daily-adventures.cz'}
+
+# Metrics of the current run, only collected with --metrics-file (see Metrics)
+metrics = None
+
+# perf_counter() value when the run should stop fetching (--deadline), or None
+_deadline = None
+# Course pages not fetched because of the deadline; their events are marked stale
+_stale_course_urls = set()
+
+# Retry policy of send_request(): responses with these statuses, connection errors
+# and timeouts are retried with exponential backoff (seconds) with full jitter
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 30
+# Longer Retry-After delays are not waited for, the request fails instead
+RETRY_AFTER_MAX = 120
+_max_retries = 3
+
+# Per-host rate limit (requests per second, burst) set by configure_session(), or None;
+# host -> TokenBucket, created on first use
+_rate_limit = None
+_rate_limiters = {}
+_rate_limiters_lock = Lock()
+
+# XPath expressions used by parse_month_days(), compiled once
+_xpath_rows = XPath('./tr')
+_xpath_cells = XPath('./td')
+_xpath_event_items = XPath('.//ul[@class="simcal-events"]/li')
+_xpath_event_title = XPath('.//span[@class="simcal-event-title"]')
+_xpath_links = XPath('.//a')
+
+# Simple Calendar feeds to scrape: WordPress sites answering the simcal_default_calendar_draw_grid action
+DEFAULT_SOURCE = {
+    'name': 'daily-adventures',
+    'base_url': 'https://daily-adventures.cz',
+    'calendar_id': 12100,
+    'referer': 'https://daily-adventures.cz/kalendar-akci-a-kurzu/',
+}
 
 # Pattern to match course duration in Czech ("POČET DNÍ: X den/dny/dní")
+# Version of parse_month_days() output, part of the month cache key;
+# bump it whenever the parser changes, so that cached months are parsed again
+MONTH_PARSER_VERSION = 1
+
 COURSE_DURATION_PATTERN = r'POČET\s+DNÍ:\s*(\d+)\s*d(?:en|ny|ní)'
 
+# Precomputed page layout (see build_layout())
+MONTH_NAMES = ['leden', 'únor', 'březen', 'duben', 'květen', 'červen', 'červenec', 'srpen', 'září', 'říjen', 'listopad', 'prosinec']
+EVENT_TITLE_MAX_LENGTH = 35
+EVENT_TITLE_TRUNCATE_AT = 32
+CONTINUATION_MAX_LENGTH = 30
+CONTINUATION_TRUNCATE_AT = 27
+
+# Search index: tokens shorter than this are left out, and so are their prefixes
+SEARCH_TOKEN_MIN_LENGTH = 2
+
+# Entries of the change feed (--changes) older than this are dropped
+CHANGES_RETENTION = timedelta(days=90)
+# Event fields compared by diff_events(); others (like 'stale') are bookkeeping of the run
+EVENT_CONTENT_FIELDS = ('title', 'url', 'start_date', 'end_date', 'duration_days', 'sources')
+
+# Serve mode (--serve): the current and the next month are retrieved every
+# --refresh-interval seconds, each further month half as often, but at least this often
+REFRESH_INTERVAL_MAX = 6 * 3600
+
 
 def main():
     p = ArgumentParser()
-    p.add_argument('--output', '-o', help='Output file (default: calendar.json)')
+    p.add_argument('--output', '-o', help='Output file (default: calendar.json, calendar.min.json or calendar.ndjson depending on --format)')
+    p.add_argument('--format', choices=['nested', 'compact', 'ndjson'], default='nested',
+        help='Output format: months with all days (nested, default), a flat minified event list (compact) '
+             'or one line per month, streamed as soon as each month is finished (ndjson)')
+    p.add_argument('--compress', action='store_true', help='Also write precompressed .gz (and .br, if brotli is installed) copies of the output files')
+    p.add_argument('--split-dir', help='Also write one compact JSON file per month and a manifest.json into this directory')
+    p.add_argument('--layout', help='Also write the render-ready week grid layout used by the web page to this file')
+    p.add_argument('--search-index', help='Also write the search index of event titles and URLs to this file')
+    p.add_argument('--changes', metavar='PATH',
+        help='Append the events added, removed and changed since the previous output to this NDJSON change feed')
+    p.add_argument('--write-unchanged', action='store_true',
+        help='Write the output files even if no event changed since the previous output')
+    p.add_argument('--source', action='append', metavar='NAME=BASE_URL#CALENDAR_ID',
+        help='Simple Calendar feed to scrape, can be repeated (default: daily-adventures=https://daily-adventures.cz#12100)')
     p.add_argument('--verbose', '-v', action='store_true', help='Verbose output')
+    p.add_argument('--jobs', '-j', type=int, default=4, help='Number of months retrieved concurrently (default: 4)')
+    p.add_argument('--course-jobs', type=int, default=8, help='Number of course pages retrieved concurrently (default: 8)')
+    p.add_argument('--per-host', type=int, default=4, help='Max concurrent course page requests per host (default: 4)')
+    p.add_argument('--rate-limit', type=float, default=10,
+        help='Max requests per second to a single host, lowered while the host is throttling us; 0 for no limit (default: 10)')
+    p.add_argument('--retries', type=int, default=3,
+        help='Retries of a request failing with a connection error, timeout or transient HTTP status (default: 3)')
+    p.add_argument('--cache-file', help='Course duration cache file (default: course_durations.json next to this script)')
+    p.add_argument('--cache-ttl', type=float, default=7, help='Days before a cached course duration is revalidated (default: 7)')
+    p.add_argument('--no-cache', action='store_true', help='Do not read or write the course duration cache')
+    p.add_argument('--refresh-cache', action='store_true', help='Ignore cached course durations, fetch them again and rewrite the cache')
+    p.add_argument('--full', action='store_true', help='Rebuild all months, even those whose HTML has not changed since the last run')
+    p.add_argument('--metrics-file', help='Write timings and counters of the run to this JSON file and print a summary')
+    p.add_argument('--deadline', type=float, metavar='SECONDS',
+        help='Wall-clock budget of the run; months and course durations not fetched in time, '
+             'or failing, are taken from the previous output file and marked as stale')
+    p.add_argument('--serve', metavar='[HOST:]PORT',
+        help='Keep running, refresh the months on an adaptive schedule and serve the calendar over HTTP '
+             '(on 127.0.0.1 unless HOST is given)')
+    p.add_argument('--refresh-interval', type=float, default=300,
+        help='Serve mode: seconds between refreshes of the current and the next month, '
+             'further months are refreshed less often (default: 300)')
     args = p.parse_args()
     setup_logging(verbose=args.verbose)
-    start_date = datetime.now(timezone.utc)
+    if args.metrics_file:
+        enable_metrics()
+    if args.deadline is not None:
+        set_deadline(args.deadline)
+        if args.output == '-':
+            p.error('--deadline needs an output file, the previous output is used for missing months')
+    for option in 'jobs', 'course_jobs', 'per_host':
+        if getattr(args, option) < 1:
+            p.error(f'--{option.replace("_", "-")} must be at least 1')
+    if args.rate_limit < 0 or args.retries < 0:
+        p.error('--rate-limit and --retries must not be negative')
+    if args.format == 'ndjson' and (args.split_dir or args.layout or args.search_index or args.compress or args.changes):
+        p.error('--split-dir, --layout, --search-index, --compress and --changes cannot be used with --format ndjson')
+    if args.serve and (args.output or args.format != 'nested' or args.split_dir or args.layout or args.search_index or
+                       args.compress or args.changes or args.deadline is not None or args.metrics_file):
+        p.error('--serve cannot be used with --output, --format, --split-dir, --layout, --search-index, --compress, '
+                '--changes, --deadline and --metrics-file')
+    if args.refresh_interval <= 0:
+        p.error('--refresh-interval must be positive')
+    try:
+        serve_address = parse_address(args.serve) if args.serve else None
+    except ValueError as e:
+        p.error(str(e))
+    try:
+        sources = [parse_source(value) for value in args.source] if args.source else [DEFAULT_SOURCE]
+    except ValueError as e:
+        p.error(str(e))
+    configure_session(
+        pool_size=args.jobs + min(args.course_jobs, args.per_host),
+        rate_limit=args.rate_limit or None,
+        max_retries=args.retries)
+    if args.cache_file:
+        cache_path = Path(args.cache_file)
+    else:
+        cache_path = Path(__file__).resolve().parent / 'course_durations.json'
+    if not args.no_cache:
+        load_course_cache(cache_path, ttl=timedelta(days=args.cache_ttl), refresh=args.refresh_cache)
+    month_dates = horizon_month_dates(datetime.now(timezone.utc))
+    build_options = dict(
+        sources=sources,
+        jobs=args.jobs,
+        course_jobs=args.course_jobs,
+        per_host=args.per_host,
+        month_cache_path=cache_path.with_name('month_cache.json'),
+        full=args.full)
+    if serve_address:
+        serve_calendar(serve_address, build_options, args.refresh_interval, cache_path=None if args.no_cache else cache_path)
+        return
+    if args.deadline is not None:
+        build_options['fallback_months'] = load_previous_months(output_file_path(args), args.format)
+    if args.format == 'ndjson':
+        # Stream the months, each one is written as soon as it is consolidated
+        months = iter_calendar_months(month_dates, **build_options)
+        if args.output == '-':
+            write_ndjson(sys.stdout, months)
+        else:
+            output_path = output_file_path(args)
+            temp_path = output_path.with_name(f'.{output_path.name}.temp')
+            with temp_path.open('w', encoding='utf-8') as f:
+                write_ndjson(f, months)
+            temp_path.rename(output_path)
+        output = None
+    else:
+        output = build_calendar(month_dates, **build_options)
+    if not args.no_cache:
+        save_course_cache(cache_path)
+    if output is not None:
+        write_outputs(output, args)
+    if metrics:
+        write_file_atomically(Path(args.metrics_file), json.dumps(metrics.to_json(), indent=2) + '\n')
+        print(metrics.summary(), file=sys.stderr)
+
+
+def write_outputs(output, args):
+    '''
+    Write the built calendar in the format(s) selected on the command line.
+
+    The output is compared with the previous output file first (see diff_events()):
+    if no event changed, no file is written (unless --write-unchanged is given,
+    some of the files do not exist yet or only the stale markers changed);
+    otherwise the changes are appended to the --changes feed.
+    '''
+    output_path = output_file_path(args)
+    if output_path:
+        with timed_phase('diff'):
+            previous_events = load_previous_events(output_path)
+            if previous_events is not None:
+                # works on the output before transform_to_json() too, diff_events() converts the dates
+                compact_output = compact_calendar(output)
+                horizon_start = compact_output['months'][0].isoformat() if compact_output['months'] else ''
+                changes = diff_events(previous_events, compact_output['events'], horizon_start)
+                logger.info(
+                    'Changes since the previous output: %d added, %d removed, %d changed',
+                    len(changes['added']), len(changes['removed']), len(changes['changed']))
+                # not a change of the events, but the files are rewritten to add or clear the markers
+                stale_changed = stale_event_keys(previous_events) != stale_event_keys(compact_output['events'])
+                if not any(changes.values()) and not stale_changed and not args.write_unchanged:
+                    other_paths = [Path(p) for p in (args.layout, args.search_index) if p]
+                    if args.split_dir:
+                        other_paths.append(Path(args.split_dir) / 'manifest.json')
+                    if all(path.exists() for path in other_paths):
+                        logger.info('No event has changed, keeping the previous output')
+                        return
+                if args.changes and any(changes.values()):
+                    append_changes(Path(args.changes), changes)
+    if args.format == 'compact' or args.split_dir or args.layout or args.search_index:
+        with timed_phase('transform_to_json'):
+            output = transform_to_json(output)
+    with timed_phase('json_dumps'):
+        if args.format == 'compact':
+            output_json = dump_compact_json(compact_calendar(output))
+        else:
+            output_json = json.dumps(output, indent=2, default=json_default)
+    with timed_phase('write_output'):
+        if output_path:
+            write_output_file(output_path, output_json + '\n', compress=args.compress)
+        else:
+            print(output_json)
+        if args.split_dir:
+            write_split_calendar(Path(args.split_dir), output, compress=args.compress)
+        if args.layout:
+            write_output_file(Path(args.layout), dump_compact_json(build_layout(output)) + '\n', compress=args.compress)
+        if args.search_index:
+            write_output_file(Path(args.search_index), dump_compact_json(build_search_index(output)) + '\n', compress=args.compress)
+
+
+def output_file_path(args):
+    '''
+    Path of the main output file selected on the command line, or None for stdout.
+    '''
+    if args.output == '-':
+        return None
+    if args.output:
+        return Path(args.output)
+    output_names = {'nested': 'calendar.json', 'compact': 'calendar.min.json', 'ndjson': 'calendar.ndjson'}
+    return Path(__file__).resolve().parent / output_names[args.format]
+
+
+def load_previous_events(path):
+    '''
+    Load the events of the previous output file (nested or compact) in the compact form,
+    or None if there is no previous output.
+    '''
+    try:
+        previous = json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logger.warning('Ignoring invalid previous output %s: %s', path, e)
+        return None
+    if 'events' in previous:
+        return previous['events']
+    return compact_calendar(previous)['events']
+
+
+def diff_events(previous_events, events, horizon_start):
+    '''
+    Compare compact events of the previous and the new output, matched by (title, url, start_date).
+    Only EVENT_CONTENT_FIELDS are compared and reported.
+    Returns {'added': [events], 'removed': [events], 'changed': [changes]}, where each change
+    has the key fields and the differing fields 'before' and 'after'.
+    Events removed only because they ended before the new horizon (`horizon_start`,
+    the first month date) are not reported, that is not a meaningful change.
+    '''
+    previous_by_key = {}
+    for event in map(event_content, previous_events):
+        key_events = previous_by_key.setdefault((event['title'], event['url'], event['start_date']), [])
+        if event not in key_events:
+            key_events.append(event)
+    events_by_key = {}
+    for event in map(event_content, events):
+        key_events = events_by_key.setdefault((event['title'], event['url'], event['start_date']), [])
+        if event not in key_events:
+            key_events.append(event)
+    changes = {'added': [], 'removed': [], 'changed': []}
+    # events without a link have url None
+    for key in sorted(previous_by_key.keys() | events_by_key.keys(), key=lambda key: (key[0], key[1] or '', key[2])):
+        before = previous_by_key.get(key, [])
+        after = events_by_key.get(key, [])
+        if len(before) == 1 and len(after) == 1:
+            if before[0] != after[0]:
+                fields = [k for k in {**before[0], **after[0]} if before[0].get(k) != after[0].get(k)]
+                changes['changed'].append({
+                    'title': key[0],
+                    'url': key[1],
+                    'start_date': key[2],
+                    'before': {k: before[0].get(k) for k in fields},
+                    'after': {k: after[0].get(k) for k in fields},
+                })
+            continue
+        changes['added'] += [e for e in after if e not in before]
+        changes['removed'] += [e for e in before if e not in after and e['end_date'] >= horizon_start]
+    return changes
+
+
+def stale_event_keys(events):
+    '''
+    Keys (title, url, start_date) of the compact events marked stale, with dates as ISO strings.
+    '''
+    return {(event['title'], event['url'], event_content(event)['start_date']) for event in events if event.get('stale')}
+
+
+def event_content(event):
+    '''
+    The EVENT_CONTENT_FIELDS of a compact event, with dates as ISO strings.
+    '''
+    return {k: v.isoformat() if isinstance(v, date) else v for k, v in event.items() if k in EVENT_CONTENT_FIELDS}
+
+
+def append_changes(path, changes):
+    '''
+    Append the changes as one line {'date': ..., 'added': ..., 'removed': ..., 'changed': ...}
+    to the NDJSON change feed, dropping entries older than CHANGES_RETENTION.
+    '''
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    try:
+        lines = path.read_text().splitlines()
+    except FileNotFoundError:
+        lines = []
+    min_date = (now - CHANGES_RETENTION).isoformat()
+    lines = [line for line in lines if line and json.loads(line)['date'] >= min_date]
+    lines.append(dump_compact_json({'date': now.isoformat(), **changes}))
+    write_file_atomically(path, '\n'.join(lines) + '\n')
+
+
+def write_ndjson(f, months):
+    '''
+    Write month records as newline-delimited JSON, flushing after each month.
+    '''
+    for month in months:
+        with timed_phase('write_output'):
+            f.write(json.dumps(month, ensure_ascii=False, default=json_default) + '\n')
+            f.flush()
+
+
+def parse_address(value):
+    '''
+    Parse the --serve address "[HOST:]PORT" into (host, port).
+    '''
+    host, _, port = value.rpartition(':')
+    try:
+        return host or '127.0.0.1', int(port)
+    except ValueError:
+        raise ValueError(f'Invalid address {value!r}, expected [HOST:]PORT') from None
+
+
+def serve_calendar(address, build_options, refresh_interval_base, cache_path=None):
+    '''
+    Serve mode: keep the calendar up to date in memory and serve it over HTTP
+    (see CalendarService and CalendarRequestHandler) until interrupted.
+    '''
+    service = CalendarService(build_options, refresh_interval_base, cache_path=cache_path)
+    service.refresh()
+    httpd = ThreadingHTTPServer(address, CalendarRequestHandler)
+    httpd.daemon_threads = True
+    httpd.service = service
+    Thread(target=httpd.serve_forever, name='http', daemon=True).start()
+    logger.info('Serving the calendar on http://%s:%s/calendar.json', *httpd.server_address[:2])
+    try:
+        while True:
+            sleep(max(service.next_refresh_at() - monotonic(), 1))
+            try:
+                service.refresh()
+            except Exception as e:
+                logger.exception('Refresh failed: %r', e)
+    except KeyboardInterrupt:
+        logger.info('Stopping')
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def refresh_interval(month_index, base):
+    '''
+    Seconds between refreshes of the month at `month_index` of the horizon (0 is the current month):
+    `base` for the current and the next month, doubling with each further month, at most REFRESH_INTERVAL_MAX.
+    '''
+    return min(base * 2 ** max(month_index - 1, 0), REFRESH_INTERVAL_MAX)
+
+
+class CalendarService:
+    '''
+    The calendar of serve mode. Keeps the last retrieved HTML of each month and
+    the files served over HTTP (path -> {'body', 'gzip', 'etag'}), built from it.
+
+    Each refresh() retrieves only the months that are due (see refresh_interval())
+    and rebuilds the calendar if the HTML of any of them changed. Rebuilding reuses
+    the parsed days of unchanged months (the month cache) and cached course durations.
+    '''
+
+    def __init__(self, build_options, refresh_interval_base, cache_path=None):
+        self.build_options = build_options
+        self.refresh_interval_base = refresh_interval_base
+        self.cache_path = cache_path
+        self.month_htmls = {}
+        self.refresh_at = {}
+        self.files = {}
+
+    def refresh(self):
+        month_dates = horizon_month_dates(datetime.now(timezone.utc))
+        now = monotonic()
+        due_dates = [d for d in month_dates if self.refresh_at.get(d, 0) <= now]
+        changed = False
+        months_htmls = iter_months_html(
+            due_dates, jobs=self.build_options['jobs'], sources=self.build_options['sources'], allow_failures=True)
+        for month_date, source_htmls in zip(due_dates, months_htmls):
+            interval = refresh_interval(month_dates.index(month_date), self.refresh_interval_base)
+            if None in source_htmls:
+                # keep the previous HTML, try again soon
+                self.refresh_at[month_date] = monotonic() + min(interval, self.refresh_interval_base)
+                continue
+            if source_htmls != self.month_htmls.get(month_date):
+                self.month_htmls[month_date] = source_htmls
+                changed = True
+            self.refresh_at[month_date] = monotonic() + interval
+        for month_date in list(self.month_htmls):
+            if month_date not in month_dates:
+                # the month has left the horizon
+                del self.month_htmls[month_date]
+                del self.refresh_at[month_date]
+                changed = True
+        if changed or not self.files:
+            self.rebuild([d for d in month_dates if d in self.month_htmls])
+
+    def rebuild(self, month_dates):
+        logger.info('Rebuilding the calendar')
+        # Course durations are looked up in the course cache again, so that they expire with its TTL,
+        # and course pages that failed in the previous rebuild are fetched again
+        _course_duration_cache.clear()
+        _course_duration_failed.clear()
+        output = build_calendar(
+            month_dates, month_htmls=[self.month_htmls[d] for d in month_dates], **self.build_options)
+        if self.cache_path:
+            save_course_cache(self.cache_path)
+        self.publish(transform_to_json(output))
+
+    def publish(self, output):
+        '''
+        Replace the served files with those of `output` (the nested output, after transform_to_json()).
+        '''
+        contents = {
+            '/calendar.json': json.dumps(output, indent=2) + '\n',
+            '/calendar.min.json': dump_compact_json(compact_calendar(output)) + '\n',
+            '/calendar_layout.json': dump_compact_json(build_layout(output)) + '\n',
+            '/search_index.json': dump_compact_json(build_search_index(output)) + '\n',
+        }
+        for file_name, content in split_calendar_files(output):
+            contents[f'/months/{file_name}'] = content
+        files = {}
+        for path, content in contents.items():
+            body = content.encode('utf-8')
+            files[path] = {
+                'body': body,
+                'gzip': gzip.compress(body, mtime=0),
+                'etag': f'"{sha256(body).hexdigest()[:32]}"',
+            }
+        self.files = files
+
+    def next_refresh_at(self):
+        return min(self.refresh_at.values(), default=monotonic() + self.refresh_interval_base)
+
+
+class CalendarRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Serves the files of the CalendarService (self.server.service): /calendar.json,
+    /calendar.min.json, /calendar_layout.json, /search_index.json, /months/manifest.json
+    and /months/YYYY-MM.json,
+    with ETag validation (304 Not Modified) and gzip content encoding.
+    '''
+
+    def do_GET(self):
+        self.send_file(include_body=True)
+
+    def do_HEAD(self):
+        self.send_file(include_body=False)
+
+    def send_file(self, include_body):
+        file = self.server.service.files.get(urlsplit(self.path).path)
+        if file is None:
+            self.send_error(404)
+            return
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match and (if_none_match.strip() == '*' or
+                              file['etag'] in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]):
+            self.send_response(304)
+            self.send_header('ETag', file['etag'])
+            self.end_headers()
+            return
+        use_gzip = accepts_gzip(self.headers.get('Accept-Encoding', ''))
+        body = file['gzip'] if use_gzip else file['body']
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', file['etag'])
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+
+def accepts_gzip(accept_encoding):
+    '''
+    Return True if the Accept-Encoding header value allows gzip.
+    '''
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            q = params.strip().removeprefix('q=')
+            try:
+                return not params.strip() or float(q) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def horizon_month_dates(start_date):
+    '''
+    Return first days of the months to scrape: from the month of `start_date`
+    till the end of the year in which the next half year ends.
+    '''
     end_date = start_date + timedelta(days=365//2)
     end_date = end_date.replace(month=12).date()
-    month_date = start_date.replace(day=1).date()
-    output = {'months': []}
+    return month_dates_between(start_date.replace(day=1).date(), end_date)
+
+
+def month_dates_between(start_date, end_date):
+    '''
+    Return first days of the months from the month of `start_date` till before `end_date`.
+    '''
+    month_dates = []
+    month_date = start_date.replace(day=1)
     while month_date < end_date:
-        month_html = retrieve_month_html(month_date)
-        parsed_days = parse_month_html(month_html, month_date)
-        output['months'].append({
-            'date': month_date,
-            'days': parsed_days,
-        })
+        month_dates.append(month_date)
         month_date = next_month(month_date)
-    output = transform_to_json(output)
-    output_json = json.dumps(output, indent=2)
-    if args.output == '-':
-        print(output_json)
+    return month_dates
+
+
+def iter_months(start_date, end_date, sources=(DEFAULT_SOURCE,), jobs=1, course_jobs=8, per_host=4):
+    '''
+    Retrieve, parse and consolidate the months from the month of `start_date` till before `end_date`.
+    Yields month records {'date': ..., 'days': [...]} in order, each as soon as it is finished.
+    '''
+    return iter_calendar_months(
+        month_dates_between(start_date, end_date),
+        sources=sources, jobs=jobs, course_jobs=course_jobs, per_host=per_host)
+
+
+def build_calendar(month_dates, course_jobs=8, per_host=4, **kwargs):
+    '''
+    Retrieve, parse and consolidate the given months.
+    Returns {'months': [{'date': ..., 'days': [...]}, ...]}.
+    See iter_calendar_months() for the arguments.
+
+    Unlike iter_calendar_months(), all months are parsed first, so that the course
+    durations of all of them are fetched in one pass, with all `course_jobs` busy.
+    '''
+    stale_months = set()
+    groups = list(iter_month_groups(month_dates, stale_months=stale_months, **kwargs))
+    with timed_phase('fetch_course_durations'):
+        prefetch_course_durations(
+            collect_course_urls([days for group in groups if isinstance(group, list) for month_date, days in group]),
+            jobs=course_jobs, per_host=per_host)
+    months = []
+    for group in groups:
+        if isinstance(group, list):
+            months.extend(consolidate_months(group, stale_months=stale_months, prefetch=False))
+        else:
+            months.append(group)
+    return {'months': months}
+
+
+def iter_calendar_months(month_dates, course_jobs=8, per_host=4, **kwargs):
+    '''
+    Retrieve, parse and consolidate the given months, yielding month records
+    {'date': ..., 'days': [...]} in order.
+
+    The months of all `sources` are retrieved together, at most `jobs` requests at once,
+    and merged into one calendar (see merge_source_days()). Course durations are looked
+    up for event URLs on the hosts of all sources.
+
+    A month is yielded as soon as no event continues from its last day into
+    the next month; months joined by such an event are consolidated together,
+    so events crossing a month boundary are not split.
+
+    With `month_cache_path` the build is incremental: months whose HTML did not change
+    reuse the days parsed in the previous run (unless `full` is set).
+
+    With `fallback_months` (month date -> month record of the previous run, see
+    load_previous_months()) a month that fails to be retrieved, or is not retrieved
+    before the deadline, does not stop the build: the days parsed from its HTML
+    in the previous run (from the month cache) are consolidated instead, or if
+    they are not cached, its previous record is used as is. Either way the month
+    and its events are marked with 'stale': True. Months without previous data
+    are left out.
+
+    With `month_htmls` (for each month a list of its HTML from each source, as yielded
+    by iter_months_html()) the months are built from the given HTML instead of being retrieved.
+    '''
+    stale_months = set()
+    for group in iter_month_groups(month_dates, stale_months=stale_months, **kwargs):
+        if isinstance(group, list):
+            yield from consolidate_months(group, course_jobs=course_jobs, per_host=per_host, stale_months=stale_months)
+        else:
+            yield group
+
+
+def iter_month_groups(
+        month_dates, stale_months, sources=(DEFAULT_SOURCE,), jobs=1,
+        month_cache_path=None, full=False, fallback_months=None, month_htmls=None):
+    '''
+    Retrieve and parse the given months (see iter_calendar_months() for the arguments),
+    yielding in order either lists of consecutive months (month date, parsed days)
+    to be consolidated together by consolidate_months(), or finished month records
+    of the previous run. Dates of the months using stale data are added to `stale_months`.
+    '''
+    _course_hosts.update(urlsplit(source['base_url']).hostname for source in sources)
+    previous_month_cache = {} if full or not month_cache_path else load_month_cache(month_cache_path)
+    month_cache = {}
+    pending = []
+    allow_failures = fallback_months is not None
+    if month_htmls is None:
+        month_htmls = iter_months_html(month_dates, jobs=jobs, sources=sources, allow_failures=allow_failures)
+    for month_date, source_htmls in zip(month_dates, month_htmls):
+        if None in source_htmls:
+            cache_keys = [f'{source["name"]}:{month_date.isoformat()}' for source in sources]
+            for cache_key in cache_keys:
+                if cache_key in previous_month_cache:
+                    month_cache[cache_key] = previous_month_cache[cache_key]
+            if all(cache_key in previous_month_cache for cache_key in cache_keys):
+                # Consolidate the days parsed in the previous run with the neighbouring months,
+                # so that events crossing the month boundary are not cut off
+                logger.warning('Using stale days of month %s parsed in the previous run', month_date)
+                if metrics:
+                    metrics.count('months_stale')
+                source_days = []
+                for cache_key in cache_keys:
+                    days = days_from_json(previous_month_cache[cache_key]['days'])
+                    for day in days:
+                        day['events'] = [{**event, 'stale': True} for event in day['events']]
+                    source_days.append(days)
+                if len(sources) == 1:
+                    days = source_days[0]
+                else:
+                    days = merge_source_days([source['name'] for source in sources], source_days)
+                if pending and not events_continue(pending[-1][1], days):
+                    yield pending
+                    pending = []
+                pending.append((month_date, days))
+                stale_months.add(month_date)
+                continue
+            if pending:
+                yield pending
+                pending = []
+            previous_month = fallback_months.get(month_date.isoformat())
+            if previous_month:
+                logger.warning('Using stale data of month %s from the previous run', month_date)
+                if metrics:
+                    metrics.count('months_stale')
+                stale_month = month_from_json(previous_month)
+                for day in stale_month['days']:
+                    for event in day['events']:
+                        event['stale'] = True
+                yield {**stale_month, 'stale': True}
+            else:
+                logger.warning('No previous data of month %s, leaving it out', month_date)
+            continue
+        with timed_phase('parse_months'):
+            source_days = []
+            for source, month_html in zip(sources, source_htmls):
+                cache_key = f'{source["name"]}:{month_date.isoformat()}'
+                preferred_host = urlsplit(source['base_url']).hostname
+                html_hash = month_html_hash(month_html, preferred_host)
+                record = previous_month_cache.get(cache_key)
+                if record and record['hash'] == html_hash:
+                    logger.debug('Month %s of %s has not changed, reusing previously parsed days', month_date, source['name'])
+                    if metrics:
+                        metrics.count('months_reused')
+                    days = days_from_json(record['days'])
+                else:
+                    # Stored as parsed, save_month_cache() serializes the dates
+                    days = parse_month_days(month_html, month_date, preferred_host=preferred_host)
+                    record = {'hash': html_hash, 'days': days}
+                    if metrics:
+                        metrics.count('months_parsed')
+                if month_cache_path:
+                    month_cache[cache_key] = record
+                source_days.append(days)
+            if len(sources) == 1:
+                days = source_days[0]
+            else:
+                days = merge_source_days([source['name'] for source in sources], source_days)
+        if pending and not events_continue(pending[-1][1], days):
+            yield pending
+            pending = []
+        pending.append((month_date, days))
+    if pending:
+        yield pending
+    if month_cache_path:
+        save_month_cache(month_cache_path, month_cache)
+
+
+def merge_source_days(source_names, source_days):
+    '''
+    Merge days of the same month parsed from several sources into one list of days.
+    Every event is tagged with the names of the sources listing it on that day;
+    identical events (same title and URL) from several sources are listed once.
+    '''
+    merged = {}
+    for source_name, days in zip(source_names, source_days):
+        for day in days:
+            merged_events = merged.setdefault(day['date'], {})
+            for event in day['events']:
+                key = (event['title'], event['url'])
+                if key not in merged_events:
+                    merged_events[key] = {'title': event['title'], 'url': event['url'], 'sources': []}
+                if source_name not in merged_events[key]['sources']:
+                    merged_events[key]['sources'].append(source_name)
+                if event.get('stale'):
+                    merged_events[key]['stale'] = True
+    return [{'date': day_date, 'events': list(events.values())} for day_date, events in sorted(merged.items())]
+
+
+def parse_source(value):
+    '''
+    Parse the --source option value NAME=BASE_URL#CALENDAR_ID.
+    '''
+    name, sep, rest = value.partition('=')
+    base_url, sep2, calendar_id = rest.partition('#')
+    if not sep or not sep2 or not name or not base_url.startswith(('http://', 'https://')) or not calendar_id.isdigit():
+        raise ValueError(f'Invalid source {value!r}, expected NAME=BASE_URL#CALENDAR_ID')
+    return {
+        'name': name,
+        'base_url': base_url.rstrip('/'),
+        'calendar_id': int(calendar_id),
+    }
+
+
+def configure_session(pool_size, rate_limit=None, max_retries=3):
+    '''
+    Size the connection pools of the shared session, so that concurrent requests
+    to one host reuse connections instead of opening and dropping extra ones.
+    There is one pool per host, shared by all months, calendars and course pages,
+    so `pool_size` should be the max number of concurrent requests to one host.
+
+    Also set the retry policy and the per-host rate limit (requests per second,
+    bursts of up to `pool_size` requests) of send_request().
+    '''
+    global _rate_limit, _max_retries
+    for prefix in 'https://', 'http://':
+        rs.mount(prefix, requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=pool_size))
+    with _rate_limiters_lock:
+        _rate_limit = (rate_limit, pool_size) if rate_limit else None
+        _rate_limiters.clear()
+    _max_retries = max_retries
+
+
+def send_request(method, url, timeout, **kwargs):
+    '''
+    Send a request with the shared session, after waiting for the rate limiter of the host.
+    Connection errors, timeouts and responses with RETRY_STATUSES are retried up to
+    `_max_retries` times, after the delay given by Retry-After or with exponential
+    backoff with jitter. Retrying stops early if it would not end by the deadline.
+    Returns the last response (its status is checked by the caller) or raises the last error.
+    '''
+    host = urlsplit(url).hostname
+    limiter = host_rate_limiter(host)
+    for attempt in range(_max_retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            r = rs.request(method, url, timeout=request_timeout(timeout), **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == _max_retries:
+                raise
+            delay = backoff_delay(attempt)
+            reason = repr(e)
+            error = e
+        else:
+            if r.status_code not in RETRY_STATUSES:
+                if limiter:
+                    limiter.recover()
+                return r
+            retry_after = parse_retry_after(r.headers.get('Retry-After'))
+            if limiter and r.status_code in (429, 503):
+                limiter.throttle(retry_after)
+            if attempt == _max_retries or (retry_after or 0) > RETRY_AFTER_MAX:
+                return r
+            delay = backoff_delay(attempt) if retry_after is None else retry_after
+            reason = f'HTTP {r.status_code}'
+            error = None
+        remaining = remaining_time()
+        if remaining is not None and delay >= remaining:
+            logger.warning('Not retrying %s %s (%s), the deadline is near', method, url, reason)
+            if error:
+                raise error
+            return r
+        logger.info('Retrying %s %s in %.1f s (%s)', method, url, delay, reason)
+        if metrics:
+            metrics.count('request_retries')
+        sleep(delay)
+
+
+def backoff_delay(attempt):
+    '''
+    Delay before retry number `attempt` (counted from 0): exponential backoff with full jitter.
+    '''
+    return uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+
+def parse_retry_after(value):
+    '''
+    Parse the Retry-After header (seconds or an HTTP date) into seconds, or None.
+    '''
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def host_rate_limiter(host):
+    '''
+    The TokenBucket limiting requests to `host`, or None if there is no rate limit.
+    '''
+    with _rate_limiters_lock:
+        if not _rate_limit:
+            return None
+        if host not in _rate_limiters:
+            _rate_limiters[host] = TokenBucket(*_rate_limit)
+        return _rate_limiters[host]
+
+
+class TokenBucket:
+    '''
+    Rate limiter of requests to one host: allows bursts of up to `burst` requests,
+    with tokens refilled at `rate` per second. When the host throttles us (429/503),
+    the rate is halved and requests wait for its Retry-After; successful requests
+    then gradually restore the rate.
+    '''
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = perf_counter()
+        self.paused_until = 0
+        self._lock = Lock()
+
+    def acquire(self):
+        waited = False
+        while True:
+            with self._lock:
+                now = perf_counter()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            remaining = remaining_time()
+            if remaining is not None and wait >= remaining:
+                raise DeadlineExceeded('Deadline reached while waiting for the rate limiter')
+            waited = True
+            sleep(wait)
+        if waited and metrics:
+            metrics.count('rate_limited_requests')
+
+    def throttle(self, retry_after=None):
+        with self._lock:
+            self.rate = max(self.rate / 2, self.max_rate / 16)
+            if retry_after:
+                self.paused_until = max(self.paused_until, perf_counter() + min(retry_after, RETRY_AFTER_MAX))
+        logger.info('Throttled, lowered the request rate to %.2f/s', self.rate)
+
+    def recover(self):
+        with self._lock:
+            self.rate = min(self.rate + self.max_rate / 16, self.max_rate)
+
+
+def is_transient_error(e):
+    '''
+    Return True if the request error `e` may not happen again (so its result must not be cached).
+    '''
+    if isinstance(e, requests.HTTPError):
+        return e.response is not None and e.response.status_code in RETRY_STATUSES
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+
+def load_previous_months(path, format='nested'):
+    '''
+    Load month records of the previous run from its output file in the given --format,
+    as month date -> month record (in JSON form), to fill in months that
+    could not be retrieved.
+    '''
+    try:
+        text = path.read_text()
+        if format == 'ndjson':
+            months = [json.loads(line) for line in text.splitlines() if line]
+        elif format == 'compact':
+            months = months_from_compact(json.loads(text))
+        else:
+            months = json.loads(text).get('months', [])
+    except FileNotFoundError:
+        logger.info('Previous calendar %s does not exist', path)
+        return {}
+    except ValueError as e:
+        logger.warning('Ignoring invalid previous calendar %s: %s', path, e)
+        return {}
+    return {month['date']: month for month in months}
+
+
+def months_from_compact(compact):
+    '''
+    Convert the compact output back to nested month records (in JSON form):
+    every event is listed on its start day, as in the nested output.
+    '''
+    events_by_date = {}
+    for event in compact['events']:
+        events_by_date.setdefault(event['start_date'], []).append(event)
+    months = []
+    for month_iso in compact['months']:
+        month_date = date.fromisoformat(month_iso)
+        days = []
+        day_date = month_date
+        while day_date.month == month_date.month:
+            days.append({'date': day_date.isoformat(), 'events': events_by_date.get(day_date.isoformat(), [])})
+            day_date += timedelta(days=1)
+        months.append({'date': month_iso, 'days': days})
+    return months
+
+
+def month_from_json(month):
+    '''
+    Convert a month record as stored in JSON back to the format yielded by iter_calendar_months().
+    '''
+    date_keys = {'date', 'start_date', 'end_date'}
+    return {
+        **month,
+        'date': date.fromisoformat(month['date']),
+        'days': [
+            {
+                **day,
+                'date': date.fromisoformat(day['date']),
+                'events': [{k: date.fromisoformat(v) if k in date_keys else v for k, v in event.items()} for event in day['events']],
+            }
+            for day in month['days']
+        ],
+    }
+
+
+def set_deadline(seconds):
+    '''
+    Set the wall-clock budget of the run, counted from now.
+    '''
+    global _deadline
+    _deadline = perf_counter() + seconds
+
+
+def remaining_time():
+    '''
+    Seconds left till the deadline (at least 0), or None if there is no deadline.
+    '''
+    if _deadline is None:
+        return None
+    return max(_deadline - perf_counter(), 0)
+
+
+def request_timeout(timeout):
+    '''
+    Timeout for a request: `timeout`, shortened so the request ends by the deadline.
+    Raises DeadlineExceeded if the deadline has passed already.
+    '''
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceeded('Deadline reached')
+    return min(timeout, remaining)
+
+
+class DeadlineExceeded (Exception):
+    pass
+
+
+def events_continue(previous_days, days):
+    '''
+    Return True if an event listed on the last of `previous_days` is listed on the first of `days` too.
+    '''
+    if not previous_days or not days:
+        return False
+    last_events = {(event['title'], event['url']) for event in previous_days[-1]['events']}
+    return any((event['title'], event['url']) in last_events for event in days[0]['events'])
+
+
+def consolidate_months(months, course_jobs=8, per_host=4, stale_months=(), prefetch=True):
+    '''
+    Consolidate consecutive months (list of (month date, parsed days)) together.
+    Yields month records {'date': ..., 'days': [...]}, those in `stale_months`
+    marked with 'stale': True. Without `prefetch` the course durations
+    must have been fetched before.
+    '''
+    months_days = [days for month_date, days in months]
+    if prefetch:
+        with timed_phase('fetch_course_durations'):
+            prefetch_course_durations(collect_course_urls(months_days), jobs=course_jobs, per_host=per_host)
+    with timed_phase('consolidate'):
+        all_days = consolidate_multiday_events([day for days in months_days for day in days])
+    for month_date, days in months:
+        month = {
+            'date': month_date,
+            'days': all_days[:len(days)],
+        }
+        if month_date in stale_months:
+            month['stale'] = True
+        yield month
+        all_days = all_days[len(days):]
+
+
+def write_file_atomically(path, content):
+    temp_path = path.with_name(f'.{path.name}.temp')
+    if isinstance(content, bytes):
+        temp_path.write_bytes(content)
     else:
-        if args.output:
-            output_path = Path(args.output)
+        temp_path.write_text(content, encoding='utf-8')
+    temp_path.rename(path)
+
+
+def write_output_file(path, content, compress=False):
+    '''
+    Write an output file, with `compress` also its .gz and .br copies
+    (.br only if the brotli package is installed).
+    '''
+    write_file_atomically(path, content)
+    if compress:
+        data = content.encode('utf-8')
+        write_file_atomically(path.with_name(path.name + '.gz'), gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli:
+            write_file_atomically(path.with_name(path.name + '.br'), brotli.compress(data))
+
+
+def dump_compact_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def compact_calendar(output):
+    '''
+    Convert the nested output (months -> days -> events, after transform_to_json())
+    to {'months': [month dates], 'events': [events]}: a flat list of distinct events
+    sorted by start date, without the empty days.
+    '''
+    events = {}
+    for month in output['months']:
+        for day in month['days']:
+            for event in day['events']:
+                event = {**event}
+                event.setdefault('start_date', day['date'])
+                event.setdefault('end_date', day['date'])
+                events.setdefault(json.dumps(event, sort_keys=True, default=json_default), event)
+    return {
+        'months': [month['date'] for month in output['months']],
+        'events': sorted(events.values(), key=lambda event: event['start_date']),
+    }
+
+
+def split_calendar(output):
+    '''
+    Split the nested output into compact per-month calendars.
+    Each month contains all events overlapping it, including events
+    that started in the previous month.
+    Returns a list of (month date, {'date': ..., 'events': [...]}).
+    '''
+    events = compact_calendar(output)['events']
+    result = []
+    for month in output['months']:
+        month_start = month['days'][0]['date']
+        month_end = month['days'][-1]['date']
+        result.append((month['date'], {
+            'date': month['date'],
+            'events': [e for e in events if e['start_date'] <= month_end and e['end_date'] >= month_start],
+        }))
+    return result
+
+
+def write_split_calendar(directory, output, compress=False):
+    '''
+    Write one compact JSON file per month (YYYY-MM.json) and manifest.json
+    listing the months, so the frontend can load only the months it shows.
+    '''
+    directory.mkdir(parents=True, exist_ok=True)
+    for file_name, content in split_calendar_files(output):
+        write_output_file(directory / file_name, content, compress=compress)
+
+
+def split_calendar_files(output):
+    '''
+    Return (file name, content) of the per-month files and of manifest.json (see write_split_calendar()).
+    '''
+    files = []
+    manifest = {'months': []}
+    for month_date, month_calendar in split_calendar(output):
+        file_name = f'{month_date[:7]}.json'
+        files.append((file_name, dump_compact_json(month_calendar) + '\n'))
+        manifest['months'].append({
+            'date': month_date,
+            'file': file_name,
+            'event_count': len(month_calendar['events']),
+        })
+    files.append(('manifest.json', dump_compact_json(manifest) + '\n'))
+    return files
+
+
+def build_layout(output):
+    '''
+    Precompute the layout rendered by app/page.tsx from the nested output (after transform_to_json()):
+    months with events, each as Monday-first week rows of day cells (None for padding).
+    Every event overlapping a month gets a lane, so that overlapping multi-day events
+    do not collide; a cell's `events` list is indexed by lane, with None for free lanes.
+    '''
+    events = compact_calendar(output)['events']
+    layout = {'months': []}
+    for month in output['months']:
+        month_start = month['days'][0]['date']
+        month_end = month['days'][-1]['date']
+        month_events = [e for e in events if e['start_date'] <= month_end and e['end_date'] >= month_start]
+        if not month_events:
+            continue
+        month_date = date.fromisoformat(month['date'])
+        cells = [None] * date.fromisoformat(month_start).weekday()
+        cells_by_date = {}
+        for day in month['days']:
+            cells_by_date[day['date']] = {
+                'date': day['date'],
+                'day': date.fromisoformat(day['date']).day,
+                'weekend': len(cells) % 7 >= 5,
+                'events': [],
+            }
+            cells.append(cells_by_date[day['date']])
+        cells += [None] * (-len(cells) % 7)
+        for event, lane in zip(month_events, assign_lanes(month_events)):
+            day_date = date.fromisoformat(max(event['start_date'], month_start))
+            last_date = date.fromisoformat(min(event['end_date'], month_end))
+            while day_date <= last_date:
+                cell_events = cells_by_date[day_date.isoformat()]['events']
+                cell_events.extend([None] * (lane + 1 - len(cell_events)))
+                cell_events[lane] = layout_event(event, day_date.isoformat())
+                day_date += timedelta(days=1)
+        for cell in cells:
+            if cell:
+                cell['has_events'] = any(cell['events'])
+        layout['months'].append({
+            'date': month['date'],
+            'label': f'{MONTH_NAMES[month_date.month - 1]} {month_date.year}',
+            'weeks': [cells[i:i + 7] for i in range(0, len(cells), 7)],
+        })
+    return layout
+
+
+def assign_lanes(events):
+    '''
+    Assign the lowest free lane to each event (interval partitioning), so that events
+    whose date ranges overlap never share a lane. Returns lanes in the order of `events`.
+    '''
+    order = sorted(range(len(events)), key=lambda i: (events[i]['start_date'], -len_days(events[i]), events[i]['title']))
+    lane_ends = []
+    lanes = [None] * len(events)
+    for i in order:
+        for lane, lane_end in enumerate(lane_ends):
+            if lane_end < events[i]['start_date']:
+                break
         else:
-            output_path = Path(__file__).resolve().parent / 'calendar.json'
-        temp_path = output_path.with_name(f'.{output_path.name}.temp')
-        temp_path.write_text(output_json + '\n')
-        temp_path.rename(output_path)
+            lane = len(lane_ends)
+            lane_ends.append(None)
+        lane_ends[lane] = events[i]['end_date']
+        lanes[i] = lane
+    return lanes
+
+
+def len_days(event):
+    return (date.fromisoformat(event['end_date']) - date.fromisoformat(event['start_date'])).days + 1
+
+
+def layout_event(event, day_date):
+    '''
+    Event as shown in the cell of `day_date`: the (truncated) label, the tooltip
+    and whether the event continues from the previous or to the next day.
+    Events taken from the previous run (see --deadline) are marked as stale.
+    '''
+    duration_days = event.get('duration_days', 1)
+    is_first_day = day_date == event['start_date']
+    if is_first_day:
+        label = truncate(event['title'], EVENT_TITLE_MAX_LENGTH, EVENT_TITLE_TRUNCATE_AT)
+    else:
+        label = truncate(event['title'], CONTINUATION_MAX_LENGTH, CONTINUATION_TRUNCATE_AT)
+    tooltip = event['title']
+    if duration_days > 1:
+        tooltip += f' ({duration_days} {"dny" if duration_days < 5 else "dní"})'
+    cell_event = {
+        'label': label,
+        'tooltip': tooltip,
+        'url': event['url'],
+        'duration_days': duration_days,
+        'is_first_day': is_first_day,
+        'is_last_day': day_date == event['end_date'],
+    }
+    if event.get('stale'):
+        cell_event['stale'] = True
+    return cell_event
+
+
+def build_search_index(output):
+    '''
+    Build the search index from the nested output (after transform_to_json()):
+
+    - `events`: the distinct events (as in compact_calendar()), their position is the event id
+    - `tokens`: token -> ids of the events with that token in the title or the URL slug
+    - `prefixes`: prefix -> ids of the events with a longer token starting with it
+
+    Tokens are folded (see fold_search_text()), so a client folds the typed words the same way
+    and looks each of them up in `tokens` and `prefixes` instead of scanning all titles.
+    '''
+    events = compact_calendar(output)['events']
+    tokens = {}
+    prefixes = {}
+    for event_id, event in enumerate(events):
+        slug = urlsplit(event['url'] or '').path.rstrip('/').rpartition('/')[2]
+        for token in set(search_tokens(event['title'])) | set(search_tokens(slug)):
+            tokens.setdefault(token, []).append(event_id)
+            for length in range(SEARCH_TOKEN_MIN_LENGTH, len(token)):
+                event_ids = prefixes.setdefault(token[:length], [])
+                if not event_ids or event_ids[-1] != event_id:
+                    event_ids.append(event_id)
+    return {
+        'events': [
+            {'title': e['title'], 'url': e['url'], 'start_date': e['start_date'], 'end_date': e['end_date']}
+            for e in events
+        ],
+        'tokens': dict(sorted(tokens.items())),
+        'prefixes': dict(sorted(prefixes.items())),
+    }
+
+
+def search_tokens(text):
+    return [token for token in re.findall(r'[a-z0-9]+', fold_search_text(text)) if len(token) >= SEARCH_TOKEN_MIN_LENGTH]
+
+
+def fold_search_text(text):
+    '''
+    Remove diacritics and case differences: "KURZ LEZENÍ NA UMĚLÉ STĚNĚ" -> "kurz lezeni na umele stene".
+    '''
+    return ''.join(c for c in normalize('NFKD', text) if not combining(c)).casefold()
+
+
+def truncate(title, max_length, truncate_at):
+    return title[:truncate_at] + '...' if len(title) > max_length else title
 
 
 def setup_logging(verbose):
@@ -88,6 +1361,15 @@ def next_month(month_date):
     return (month_date.replace(day=1) + timedelta(days=32)).replace(day=1)
 
 
+def json_default(value):
+    '''
+    The `default` hook for json.dumps(), serializes dates without copying the whole structure.
+    '''
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Unsupported type: {type(value)}')
+
+
 def transform_to_json(value):
     if isinstance(value, (list, tuple)):
         return [transform_to_json(x) for x in value]
@@ -100,24 +1382,169 @@ def transform_to_json(value):
     raise ValueError(f'Unsupported type: {type(value)}')
 
 
-def retrieve_month_html(month_date):
-    logger.info('Retrieving events for %s', month_date)
-    url = 'https://daily-adventures.cz/wp-admin/admin-ajax.php'
+def enable_metrics():
+    '''
+    Start collecting metrics of this run into the module-level `metrics`.
+    '''
+    global metrics
+    metrics = Metrics()
+    rs.hooks['response'].append(metrics.record_response)
+    return metrics
+
+
+def timed_phase(name):
+    '''
+    Context manager measuring duration of a phase of the run; does nothing if metrics are off.
+    '''
+    return metrics.phase(name) if metrics else nullcontext()
+
+
+class Metrics:
+    '''
+    Timings and counters of a scraper run: duration of each phase, each HTTP request
+    with its status and size, course duration cache hits and misses and peak RSS.
+    '''
+
+    def __init__(self):
+        self.start_time = perf_counter()
+        self.phases = {}
+        self.requests = []
+        self.counters = Counter()
+        self._lock = Lock()
+
+    @contextmanager
+    def phase(self, name):
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - t0
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0) + elapsed
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def record_response(self, r, *args, **kwargs):
+        '''
+        Response hook for requests.Session.
+        '''
+        with self._lock:
+            self.requests.append({
+                'method': r.request.method,
+                'url': r.url,
+                'status': r.status_code,
+                'seconds': r.elapsed.total_seconds(),
+                'bytes': len(r.content),
+            })
+
+    def to_json(self):
+        status_counts = Counter(str(rq['status']) for rq in self.requests)
+        cache_lookups = self.counters['course_cache_hit'] + self.counters['course_cache_revalidated'] + self.counters['course_cache_miss']
+        return {
+            'total_seconds': perf_counter() - self.start_time,
+            'phases': self.phases,
+            'request_count': len(self.requests),
+            'request_seconds': sum(rq['seconds'] for rq in self.requests),
+            'bytes_downloaded': sum(rq['bytes'] for rq in self.requests),
+            'status_counts': dict(sorted(status_counts.items())),
+            'counters': dict(sorted(self.counters.items())),
+            'course_cache_hit_ratio': (self.counters['course_cache_hit'] + self.counters['course_cache_revalidated']) / cache_lookups if cache_lookups else None,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'requests': self.requests,
+        }
+
+    def summary(self):
+        data = self.to_json()
+        lines = [f'{"phase":<24} {"seconds":>8}']
+        for name, seconds in data['phases'].items():
+            lines.append(f'{name:<24} {seconds:>8.3f}')
+        lines.append(f'{"total":<24} {data["total_seconds"]:>8.3f}')
+        lines.append('')
+        lines.append(f'requests: {data["request_count"]} ({data["request_seconds"]:.3f} s), downloaded: {data["bytes_downloaded"]:,} bytes')
+        lines.append('HTTP status: ' + (', '.join(f'{k}: {v}' for k, v in data['status_counts'].items()) or '-'))
+        lines.append('counters: ' + (', '.join(f'{k}: {v}' for k, v in data['counters'].items()) or '-'))
+        if data['course_cache_hit_ratio'] is not None:
+            lines.append(f'course cache hit ratio: {data["course_cache_hit_ratio"]:.0%}')
+        if data['peak_rss_bytes']:
+            lines.append(f'peak RSS: {data["peak_rss_bytes"] / 2**20:.1f} MiB')
+        return '\n'.join(lines)
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def iter_months_html(month_dates, jobs=1, sources=(DEFAULT_SOURCE,), allow_failures=False):
+    '''
+    Retrieve HTML of all given months of all sources, at most `jobs` requests at once,
+    nearer months first. For each month yields a list of its HTML from each source,
+    as soon as it and all the previous months are retrieved.
+
+    If any month fails, the remaining requests are cancelled and the error is raised.
+    With `allow_failures` the failed months, and the months not retrieved before
+    the deadline, are yielded as None instead.
+    '''
+    requests_args = [(month_date, source) for month_date in month_dates for source in sources]
+    if not requests_args:
+        return
+    with ThreadPoolExecutor(max_workers=min(jobs, len(requests_args)), thread_name_prefix='month') as executor:
+        futures = [executor.submit(retrieve_month_html, *args) for args in requests_args]
+        try:
+            for i in range(0, len(futures), len(sources)):
+                source_htmls = []
+                for f, (month_date, source) in zip(futures[i:i + len(sources)], requests_args[i:i + len(sources)]):
+                    with timed_phase('retrieve_months'):
+                        if allow_failures:
+                            source_htmls.append(_month_html_or_none(f, month_date, source))
+                        else:
+                            source_htmls.append(f.result())
+                yield source_htmls
+        finally:
+            # on error, or when the consumer stops early
+            for f in futures:
+                f.cancel()
+
+
+def _month_html_or_none(future, month_date, source):
+    try:
+        return future.result(timeout=remaining_time())
+    except (FutureTimeoutError, DeadlineExceeded):
+        future.cancel()
+        logger.warning('Deadline reached before month %s of %s was retrieved', month_date, source['name'])
+        return None
+    except Exception as e:
+        logger.warning('Failed to retrieve month %s of %s: %r', month_date, source['name'], e)
+        return None
+
+
+def retrieve_month_html(month_date, source=DEFAULT_SOURCE):
+    logger.info('Retrieving events for %s from %s', month_date, source['name'])
+    base_url = source['base_url']
+    url = f'{base_url}/wp-admin/admin-ajax.php'
     headers = {
-        'authority': 'daily-adventures.cz',
+        'authority': urlsplit(base_url).netloc,
         'accept': 'application/json, text/javascript, */*; q=0.01',
         'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
-        'origin': 'https://daily-adventures.cz',
-        'referer': 'https://daily-adventures.cz/kalendar-akci-a-kurzu/',
+        'origin': base_url,
+        'referer': source.get('referer', f'{base_url}/'),
     }
     data = {
         'action': 'simcal_default_calendar_draw_grid',
         'year': month_date.year,
         'month': month_date.month,
-        'id': 12100,
+        'id': source['calendar_id'],
     }
     logger.debug('POST %s data: %s', url, data)
-    r = rs.post(url, headers=headers, data=data, timeout=30)
+    r = send_request('POST', url, headers=headers, data=data, timeout=30)
     r.raise_for_status()
     rj = r.json()
     logger.debug('Response: %s', smart_repr(rj))
@@ -128,12 +1555,21 @@ def retrieve_month_html(month_date):
 
 
 def parse_month_html(data, month_date):
+    return consolidate_multiday_events(parse_month_days(data, month_date))
+
+
+def parse_month_days(data, month_date, preferred_host='daily-adventures.cz'):
+    '''
+    Parse the calendar grid HTML into a list of days, each with the events
+    listed on that day (before multi-day consolidation).
+    Of the event links, the one pointing to `preferred_host` is used as the event URL.
+    '''
     tbody = fragment_fromstring(data)
+    debug = logger.isEnabledFor(DEBUG)
     previous_day = None
     result_days = []
-    for tr in tbody.xpath('./tr'):
-        for td in tr.xpath('./td'):
-            td_html = tostring(td, encoding='utf-8').decode('utf-8')
+    for tr in _xpath_rows(tbody):
+        for td in _xpath_cells(tr):
             try:
                 td_classes = td.attrib['class'].split()
                 if 'simcal-day-void' in td_classes:
@@ -159,26 +1595,29 @@ def parse_month_html(data, month_date):
                 }
                 result_days.append(result_day)
 
-                logger.debug('day: %s day_date: %s', day, day_date)
+                if debug:
+                    logger.debug('day: %s day_date: %s', day, day_date)
 
-                li_events = td.xpath('.//ul[@class="simcal-events"]/li')
+                li_events = _xpath_event_items(td)
                 assert bool(li_events) == ('simcal-day-has-events' in td_classes)
 
                 for li_event in li_events:
                     li_event_classes = li_event.attrib['class'].split()
                     assert 'simcal-event' in li_event_classes
 
-                    span_title = li_event.xpath('.//span[@class="simcal-event-title"]')[0]
-                    title = span_title.text_content()
-                    logger.debug('  title: %r', title)
+                    title = _xpath_event_title(li_event)[0].text_content()
+                    if debug:
+                        logger.debug('  title: %r', title)
 
                     urls = []
                     preferred_url = None
-                    for a in li_event.xpath('.//a'):
-                        logger.debug('  a: %r -> %r', a.text_content(), a.attrib['href'])
-                        urls.append(a.attrib['href'])
-                        if 'daily-adventures.cz' in a.attrib['href']:
-                            preferred_url = a.attrib['href']
+                    for a in _xpath_links(li_event):
+                        href = a.attrib['href']
+                        if debug:
+                            logger.debug('  a: %r -> %r', a.text_content(), href)
+                        urls.append(href)
+                        if preferred_host in href:
+                            preferred_url = href
 
                     if not preferred_url and urls:
                         preferred_url = urls[0]
@@ -188,175 +1627,357 @@ def parse_month_html(data, month_date):
                         'url': preferred_url,
                     })
             except Exception as e:
+                # Serialize the cell only now, it is needed just for the error message
+                td_html = tostring(td, encoding='utf-8').decode('utf-8')
                 raise Exception(f'Failed to parse {td_html.strip()}: {e}') from e
 
-            #print(td)
-            #print(td.text_content())
-            #print(tostring(td, pretty_print=True, encoding='utf-8').decode('utf-8'))
+    return result_days
+
+
+def collect_course_urls(months_days):
+    '''
+    Return distinct course page URLs of all events in the given months
+    (list of lists of days), in order of first appearance.
+    '''
+    urls = {}
+    for days in months_days:
+        for day in days:
+            for event in day['events']:
+                if is_course_url(event['url']):
+                    urls[event['url']] = None
+    return list(urls)
+
 
-    # Consolidate multi-day events
-    return consolidate_multiday_events(result_days)
+def is_course_url(url):
+    '''
+    Return True if `url` points to one of the scraped sites (a course page whose duration is looked up).
+    '''
+    if not url:
+        return False
+    host = urlsplit(url).hostname or ''
+    return any(host == course_host or host.endswith(f'.{course_host}') for course_host in _course_hosts)
+
+
+def prefetch_course_durations(urls, jobs=8, per_host=4):
+    '''
+    Resolve course durations of all given URLs concurrently, so that
+    consolidate_multiday_events() only reads already cached results.
+    At most `jobs` requests run at once and at most `per_host` of them
+    go to the same host.
+    '''
+    urls = [
+        url for url in dict.fromkeys(urls)
+        if is_course_url(url) and url not in _course_duration_cache and url not in _course_duration_failed]
+    if not urls:
+        return
+    logger.info('Fetching %d course pages', len(urls))
+    host_semaphores = {host: BoundedSemaphore(per_host) for host in {urlsplit(url).hostname for url in urls}}
+
+    def fetch(url):
+        with host_semaphores[urlsplit(url).hostname]:
+            return fetch_course_duration(url)
+
+    with ThreadPoolExecutor(max_workers=min(jobs, len(urls)), thread_name_prefix='course') as executor:
+        for _ in executor.map(fetch, urls):
+            pass
 
 
 def fetch_course_duration(url):
     """
     Fetch the course page and extract the actual duration from the 'POČET DNÍ:' field.
     Returns the number of days the course actually lasts, or None if not found.
+    Concurrent calls for the same URL share a single request.
     """
-    if not url or 'daily-adventures.cz' not in url:
+    if not is_course_url(url):
         return None
-    
-    # Check cache first
-    if url in _course_duration_cache:
-        return _course_duration_cache[url]
-    
+
+    with _course_duration_lock:
+        # Check cache first
+        if url in _course_duration_cache:
+            return _course_duration_cache[url]
+        if url in _course_duration_failed:
+            return None
+        future = _course_duration_pending.get(url)
+        if future is None:
+            future = _course_duration_pending[url] = Future()
+            is_owner = True
+        else:
+            is_owner = False
+
+    if not is_owner:
+        return future.result()
+
     try:
+        days = _download_course_duration(url)
+    except requests.RequestException as e:
+        # Transient failure (retries exhausted): the duration is unknown in this run,
+        # but it is not stored in the course cache, so the next run tries again
+        logger.warning(f'Error fetching course page {url}: {e}')
+        with _course_duration_lock:
+            _course_duration_failed.add(url)
+            del _course_duration_pending[url]
+        future.set_result(None)
+        return None
+    except BaseException as e:
+        with _course_duration_lock:
+            del _course_duration_pending[url]
+        future.set_exception(e)
+        raise
+    with _course_duration_lock:
+        _course_duration_cache[url] = days
+        del _course_duration_pending[url]
+    future.set_result(days)
+    return days
+
+
+def load_course_cache(path, ttl=timedelta(days=7), refresh=False):
+    '''
+    Load the persistent course duration cache from a JSON file.
+    Entries older than `ttl` are revalidated with a conditional GET when used.
+    With `refresh` the file is not read, so all course pages are fetched again.
+    Durations resolved (or failed to be fetched) before in this process are forgotten,
+    so that they are looked up (and stored) through the loaded cache.
+    '''
+    global _course_cache_ttl
+    _course_cache_ttl = ttl
+    _course_cache_entries.clear()
+    with _course_duration_lock:
+        _course_duration_cache.clear()
+        _course_duration_failed.clear()
+    if refresh:
+        logger.info('Refreshing course duration cache %s', path)
+        return
+    try:
+        entries = json.loads(path.read_text())
+    except FileNotFoundError:
+        logger.info('Course duration cache %s does not exist yet', path)
+        return
+    except ValueError as e:
+        logger.warning('Ignoring invalid course duration cache %s: %s', path, e)
+        return
+    _course_cache_entries.update(entries)
+    logger.info('Loaded %d entries from course duration cache %s', len(entries), path)
+
+
+def save_course_cache(path):
+    write_file_atomically(path, json.dumps(_course_cache_entries, indent=2, sort_keys=True) + '\n')
+    logger.info('Saved %d entries to course duration cache %s', len(_course_cache_entries), path)
+
+
+def load_month_cache(path):
+    '''
+    Load results of the previous run: month date -> {'hash', 'days'},
+    where 'days' are the days parsed from the month HTML with that hash.
+    '''
+    try:
+        return json.loads(path.read_text())
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        logger.warning('Ignoring invalid month cache %s: %s', path, e)
+        return {}
+
+
+def save_month_cache(path, month_cache):
+    write_file_atomically(path, json.dumps(month_cache, default=json_default) + '\n')
+
+
+def month_html_hash(month_html, preferred_host):
+    '''
+    Month cache key of the month HTML: the days parsed from it depend also on
+    the parser version and on the preferred host of the event URLs.
+    '''
+    return sha256(f'{MONTH_PARSER_VERSION}\n{preferred_host}\n{month_html}'.encode('utf-8')).hexdigest()
+
+
+def days_from_json(days):
+    '''
+    Convert days as stored in JSON (with ISO dates) back to the format returned by parse_month_days().
+    '''
+    return [{'date': date.fromisoformat(day['date']), 'events': day['events']} for day in days]
+
+
+def _course_cache_entry_is_fresh(entry, now):
+    return bool(entry) and now - datetime.fromisoformat(entry['fetched_at']) < _course_cache_ttl
+
+
+def _download_course_duration(url):
+    now = datetime.now(timezone.utc)
+    entry = _course_cache_entries.get(url)
+    if _course_cache_entry_is_fresh(entry, now):
+        logger.debug('Using cached duration for %s: %s', url, entry['days'])
+        if metrics:
+            metrics.count('course_cache_hit')
+        return entry['days']
+    try:
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
         logger.debug(f'Fetching course page: {url}')
-        r = rs.get(url, timeout=10)
+        r = send_request('GET', url, headers=headers, timeout=10)
+        if entry and r.status_code == 304:
+            logger.debug('Course page not modified: %s', url)
+            if metrics:
+                metrics.count('course_cache_revalidated')
+            entry['fetched_at'] = now.isoformat()
+            return entry['days']
         r.raise_for_status()
-        doc = document_fromstring(r.text)
-        
-        # Get the full text content
-        text = doc.text_content()
-        
-        # Look for "POČET DNÍ:" pattern (NUMBER OF DAYS:)
-        # Patterns: "POČET DNÍ: 1 den", "POČET DNÍ: 2 dny", "POČET DNÍ: 3 dny"
-        match = re.search(COURSE_DURATION_PATTERN, text, re.IGNORECASE)
-        if match:
-            days = int(match.group(1))
+        if metrics:
+            metrics.count('course_cache_miss')
+        with timed_phase('parse_course_pages'):
+            days = parse_course_duration(r.text)
+        _course_cache_entries[url] = {
+            'days': days,
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'fetched_at': now.isoformat(),
+        }
+        if days is not None:
             logger.debug(f'Found duration for {url}: {days} days')
-            _course_duration_cache[url] = days
-            return days
-        
-        logger.debug(f'Duration not found for {url}')
-        _course_duration_cache[url] = None
-        return None
+        else:
+            logger.debug(f'Duration not found for {url}')
+        return days
+    except DeadlineExceeded:
+        # Not fetched because of the deadline, use the cached duration even if it is old
+        _stale_course_urls.add(url)
+        if metrics:
+            metrics.count('course_durations_stale')
+        return entry['days'] if entry else None
     except Exception as e:
+        if entry:
+            logger.warning(f'Error fetching course page {url}, using cached duration: {e}')
+            return entry['days']
+        if is_transient_error(e):
+            # Not cached, see fetch_course_duration()
+            raise
         logger.warning(f'Error fetching course page {url}: {e}')
-        _course_duration_cache[url] = None
         return None
 
 
+def parse_course_duration(html):
+    '''
+    Extract the course duration in days from the course page HTML, or None if not found.
+    '''
+    doc = document_fromstring(html)
+
+    # Get the full text content
+    text = doc.text_content()
+
+    # Look for "POČET DNÍ:" pattern (NUMBER OF DAYS:)
+    # Patterns: "POČET DNÍ: 1 den", "POČET DNÍ: 2 dny", "POČET DNÍ: 3 dny"
+    match = re.search(COURSE_DURATION_PATTERN, text, re.IGNORECASE)
+    if match:
+        return int(match.group(1))
+    return None
+
+
 def consolidate_multiday_events(days):
-    """Convert events that repeat on consecutive days into multi-day event ranges."""
-    # Build a map of event title+url -> dates
-    event_dates = {}
+    """
+    Convert events that repeat on consecutive days into multi-day event ranges.
+    The days must be sorted by date; they may span several months, so events
+    crossing a month boundary are consolidated into one.
+    """
+    # Build sorted runs of consecutive dates for each event title+url
+    event_ranges = {}
     for day in days:
         for event in day['events']:
             key = (event['title'], event['url'])
-            if key not in event_dates:
-                event_dates[key] = []
-            event_dates[key].append(day['date'])
-    
-    # Find consecutive date ranges for each event and fetch actual duration
-    event_ranges = {}
-    event_actual_durations = {}
-    
-    for (title, url), dates in event_dates.items():
-        dates.sort()
-        ranges = []
-        current_start = dates[0]
-        current_end = dates[0]
-        
-        for i in range(1, len(dates)):
-            if dates[i] == current_end + timedelta(days=1):
+            ranges = event_ranges.get(key)
+            if ranges is None:
+                event_ranges[key] = [[day['date'], day['date']]]
+            elif day['date'] == ranges[-1][1] + timedelta(days=1):
                 # Consecutive day
-                current_end = dates[i]
-            else:
-                # Gap found, save current range and start new one
-                ranges.append((current_start, current_end))
-                current_start = dates[i]
-                current_end = dates[i]
-        
-        # Don't forget the last range
-        ranges.append((current_start, current_end))
-        
-        event_ranges[(title, url)] = ranges
-        
-        # Fetch actual duration from course page
-        actual_duration = fetch_course_duration(url)
-        event_actual_durations[(title, url)] = actual_duration
-    
-    # Build new days structure with events properly categorized
+                ranges[-1][1] = day['date']
+            elif day['date'] != ranges[-1][1]:
+                # Gap found, start a new range
+                ranges.append([day['date'], day['date']])
+
+    # Fetch actual duration from course page (once per event title+url)
+    event_actual_durations = {key: fetch_course_duration(key[1]) for key in event_ranges}
+
+    # Build new days structure with events properly categorized.
+    # Days are processed in date order, so the range a day belongs to is found
+    # by advancing a per-event position in its sorted ranges instead of scanning them all.
+    range_positions = dict.fromkeys(event_ranges, 0)
     result_days = []
     processed_events = set()  # Track (title, url, start_date) to avoid duplicates
-    
+
     for day in days:
         new_day = {
             'date': day['date'],
             'events': [],
         }
-        
+
         for event in day['events']:
             key = (event['title'], event['url'])
             ranges = event_ranges[key]
-            actual_duration = event_actual_durations.get(key)
-            
-            # Find which range this day belongs to
-            for start_date, end_date in ranges:
-                if start_date <= day['date'] <= end_date:
-                    calendar_duration = (end_date - start_date).days + 1
-                    
-                    # Determine event type based on actual duration vs calendar duration
-                    event_type = None
-                    
-                    if actual_duration is not None:
-                        # We have actual duration from the course page
-                        if actual_duration == 1 and calendar_duration > 1:
-                            # Single-day course repeated on consecutive days
-                            event_type = 'repeated_single_day'
-                        elif actual_duration > 1:
-                            # Multi-day continuous event
-                            event_type = 'multi_day'
-                        else:
-                            # Single day event
-                            event_type = 'single_day'
-                    else:
-                        # Fallback: if calendar duration > 1, assume it might be multi-day
-                        # but we're not certain
-                        if calendar_duration > 1:
-                            event_type = 'multi_day'  # Conservative assumption
-                        else:
-                            event_type = 'single_day'
-                    
-                    # For repeated single-day events, add an event for each day
-                    # For multi-day events, only add on the first day
-                    should_add = False
-                    if event_type == 'repeated_single_day':
-                        # Add event on each day of the range
-                        event_key_single = (event['title'], event['url'], day['date'])
-                        if event_key_single not in processed_events:
-                            should_add = True
-                            processed_events.add(event_key_single)
-                    else:
-                        # Multi-day or single-day: only add on first day
-                        event_key = (event['title'], event['url'], start_date)
-                        if day['date'] == start_date and event_key not in processed_events:
-                            should_add = True
-                            processed_events.add(event_key)
-                    
-                    if should_add:
-                        new_event = {
-                            'title': event['title'],
-                            'url': event['url'],
-                        }
-                        
-                        if event_type == 'repeated_single_day':
-                            # For repeated single-day events, use the single day date
-                            new_event['start_date'] = day['date']
-                            new_event['end_date'] = day['date']
-                        else:
-                            # For multi-day or single-day events
-                            new_event['start_date'] = start_date
-                            new_event['end_date'] = end_date
-                            if calendar_duration > 1:
-                                new_event['duration_days'] = calendar_duration
-                        
-                        new_day['events'].append(new_event)
-                    break
-        
+            position = range_positions[key]
+            while ranges[position][1] < day['date']:
+                position += 1
+            range_positions[key] = position
+            start_date, end_date = ranges[position]
+            actual_duration = event_actual_durations[key]
+            calendar_duration = (end_date - start_date).days + 1
+
+            # Determine event type based on actual duration vs calendar duration
+            if actual_duration is not None:
+                # We have actual duration from the course page
+                if actual_duration == 1 and calendar_duration > 1:
+                    # Single-day course repeated on consecutive days
+                    event_type = 'repeated_single_day'
+                elif actual_duration > 1:
+                    # Multi-day continuous event
+                    event_type = 'multi_day'
+                else:
+                    # Single day event
+                    event_type = 'single_day'
+            else:
+                # Fallback: if calendar duration > 1, assume it might be multi-day
+                # but we're not certain
+                if calendar_duration > 1:
+                    event_type = 'multi_day'  # Conservative assumption
+                else:
+                    event_type = 'single_day'
+
+            # For repeated single-day events, add an event for each day
+            # For multi-day events, only add on the first day
+            if event_type == 'repeated_single_day':
+                event_key = (event['title'], event['url'], day['date'])
+                should_add = event_key not in processed_events
+            else:
+                event_key = (event['title'], event['url'], start_date)
+                should_add = day['date'] == start_date and event_key not in processed_events
+            if not should_add:
+                continue
+            processed_events.add(event_key)
+
+            new_event = {
+                'title': event['title'],
+                'url': event['url'],
+            }
+            if 'sources' in event:
+                new_event['sources'] = event['sources']
+            if event.get('stale') or event['url'] in _stale_course_urls:
+                # Listed in a month not retrieved, or course duration not verified, because of the deadline
+                new_event['stale'] = True
+
+            if event_type == 'repeated_single_day':
+                # For repeated single-day events, use the single day date
+                new_event['start_date'] = day['date']
+                new_event['end_date'] = day['date']
+            else:
+                # For multi-day or single-day events
+                new_event['start_date'] = start_date
+                new_event['end_date'] = end_date
+                if calendar_duration > 1:
+                    new_event['duration_days'] = calendar_duration
+
+            new_day['events'].append(new_event)
+
         result_days.append(new_day)
-    
+
     return result_days
 
 
@@ -390,7 +2011,13 @@ sample_response = '''
 '''
 
 
-def test_parse_month_html():
+def test_parse_month_html(monkeypatch):
+    # durations of the linked course pages, so that the test does not fetch them
+    monkeypatch.setattr(sys.modules[__name__], '_course_duration_cache', {
+        'https://daily-adventures.cz/eshop/lavinovy-kurz-pro-zacatecniky-jeseniky/': 3,
+        'https://daily-adventures.cz/eshop/skialpovy-kurz-pro-zacatecniky-jeseniky/': 3,
+        'https://daily-adventures.cz/eshop/zakladni-kurz-lezeni-na-umele-stene/': 1,
+    })
     parsed_days = parse_month_html(decompress(b64decode(sample_response.strip())).decode('utf-8'), date(2024, 3, 1))
     assert parsed_days == [
         {'date': date(2024, 3, 1), 'events': [{'title': 'LAVINOVÝ KURZ - JESENÍKY', 'url': 'https://daily-adventures.cz/eshop/lavinovy-kurz-pro-zacatecniky-jeseniky/', 'start_date': date(2024, 3, 1), 'end_date': date(2024, 3, 3), 'duration_days': 3}]},
@@ -427,6 +2054,368 @@ def test_parse_month_html():
     ]
 
 
+def test_consolidate_multiday_events_across_months():
+    url = 'https://example.com/kurz/'
+    days = [
+        {'date': date(2024, 1, 29), 'events': []},
+        {'date': date(2024, 1, 30), 'events': [{'title': 'Kurz', 'url': url}]},
+        {'date': date(2024, 1, 31), 'events': [{'title': 'Kurz', 'url': url}]},
+        {'date': date(2024, 2, 1), 'events': [{'title': 'Kurz', 'url': url}]},
+        {'date': date(2024, 2, 2), 'events': []},
+        {'date': date(2024, 2, 3), 'events': [{'title': 'Kurz', 'url': url}]},
+    ]
+    assert consolidate_multiday_events(days) == [
+        {'date': date(2024, 1, 29), 'events': []},
+        {'date': date(2024, 1, 30), 'events': [{'title': 'Kurz', 'url': url, 'start_date': date(2024, 1, 30), 'end_date': date(2024, 2, 1), 'duration_days': 3}]},
+        {'date': date(2024, 1, 31), 'events': []},
+        {'date': date(2024, 2, 1), 'events': []},
+        {'date': date(2024, 2, 2), 'events': []},
+        {'date': date(2024, 2, 3), 'events': [{'title': 'Kurz', 'url': url, 'start_date': date(2024, 2, 3), 'end_date': date(2024, 2, 3)}]},
+    ]
+
+
+def test_events_continue():
+    kurz = {'title': 'Kurz', 'url': 'https://example.com/kurz/'}
+    january = [{'date': date(2024, 1, 30), 'events': [kurz]}, {'date': date(2024, 1, 31), 'events': [kurz]}]
+    assert events_continue(january, [{'date': date(2024, 2, 1), 'events': [kurz]}])
+    assert not events_continue(january, [{'date': date(2024, 2, 1), 'events': []}, {'date': date(2024, 2, 2), 'events': [kurz]}])
+    assert not events_continue(january, [{'date': date(2024, 2, 1), 'events': [{**kurz, 'title': 'Jiný kurz'}]}])
+
+
+def test_merge_source_days(monkeypatch):
+    kurz = {'title': 'Kurz', 'url': 'https://example.com/kurz/'}
+    vylet = {'title': 'Výlet', 'url': 'https://example.org/vylet/'}
+    a_days = [{'date': date(2024, 3, 1), 'events': [kurz]}, {'date': date(2024, 3, 2), 'events': []}]
+    b_days = [{'date': date(2024, 3, 1), 'events': [vylet, kurz]}, {'date': date(2024, 3, 2), 'events': [vylet]}]
+    assert merge_source_days(['a', 'b'], [a_days, b_days]) == [
+        {'date': date(2024, 3, 1), 'events': [{**kurz, 'sources': ['a', 'b']}, {**vylet, 'sources': ['b']}]},
+        {'date': date(2024, 3, 2), 'events': [{**vylet, 'sources': ['b']}]},
+    ]
+
+    assert is_course_url('https://daily-adventures.cz/eshop/kurz/')
+    assert not is_course_url('https://example.com/kurz/')
+    monkeypatch.setattr(sys.modules[__name__], '_course_hosts', {*_course_hosts, 'example.com'})
+    assert is_course_url('https://www.example.com/kurz/')
+
+
+def test_compact_and_split_calendar():
+    lavina = {'title': 'LAVINOVÝ KURZ', 'url': 'https://example.com/lavina/', 'start_date': '2024-01-30', 'end_date': '2024-02-01', 'duration_days': 3}
+    lezeni = {'title': 'KURZ LEZENÍ', 'url': 'https://example.com/lezeni/', 'start_date': '2024-02-02', 'end_date': '2024-02-02'}
+    output = {'months': [
+        {'date': '2024-01-01', 'days': [{'date': '2024-01-30', 'events': [lavina]}, {'date': '2024-01-31', 'events': []}]},
+        {'date': '2024-02-01', 'days': [{'date': '2024-02-01', 'events': []}, {'date': '2024-02-02', 'events': [lezeni, lezeni]}]},
+    ]}
+    assert compact_calendar(output) == {'months': ['2024-01-01', '2024-02-01'], 'events': [lavina, lezeni]}
+    previous_months = months_from_compact(compact_calendar(output))
+    assert [len(month['days']) for month in previous_months] == [31, 29]
+    assert previous_months[0]['days'][29] == {'date': '2024-01-30', 'events': [lavina]}
+    assert split_calendar(output) == [
+        ('2024-01-01', {'date': '2024-01-01', 'events': [lavina]}),
+        ('2024-02-01', {'date': '2024-02-01', 'events': [lavina, lezeni]}),
+    ]
+
+
+def test_build_layout():
+    long_title = 'KURZ VIA FERRATA SOLNÁ KOMORA – RAKOUSKO - Instruktor Lukáš'
+    output = {'months': [{'date': '2024-04-01', 'days': [
+        {'date': '2024-04-01', 'events': [{'title': 'A', 'url': 'a', 'start_date': '2024-04-01', 'end_date': '2024-04-02', 'duration_days': 2}]},
+        {'date': '2024-04-02', 'events': [{'title': long_title, 'url': 'b', 'start_date': '2024-04-02', 'end_date': '2024-04-03', 'duration_days': 2}]},
+        {'date': '2024-04-03', 'events': [{'title': 'C', 'url': 'c', 'start_date': '2024-04-03', 'end_date': '2024-04-03'}]},
+    ]}]}
+    layout = build_layout(output)
+    [month] = layout['months']
+    assert month['label'] == 'duben 2024'
+    [week] = month['weeks']
+    assert [cell and cell['day'] for cell in week] == [1, 2, 3, None, None, None, None]
+    assert [[e and e['label'] for e in cell['events']] for cell in week[:3]] == [
+        ['A'],
+        ['A', long_title[:32] + '...'],
+        ['C', long_title[:27] + '...'],
+    ]
+    assert week[1]['events'][0] == {
+        'label': 'A', 'tooltip': 'A (2 dny)', 'url': 'a', 'duration_days': 2,
+        'is_first_day': False, 'is_last_day': True,
+    }
+
+
+def test_build_search_index():
+    output = {'months': [{'date': '2024-03-01', 'days': [
+        {'date': '2024-03-01', 'events': [{'title': 'Skialpový kurz - Jeseníky', 'url': 'https://example.com/eshop/skialp-jeseniky/', 'start_date': '2024-03-01', 'end_date': '2024-03-03'}]},
+        {'date': '2024-03-02', 'events': [{'title': 'KURZ LEZENÍ NA UMĚLÉ STĚNĚ', 'url': 'https://example.com/eshop/lezeni/', 'start_date': '2024-03-02', 'end_date': '2024-03-02'}]},
+        {'date': '2024-03-03', 'events': [{'title': 'Výprava bez odkazu', 'url': None, 'start_date': '2024-03-03', 'end_date': '2024-03-03'}]},
+    ]}]}
+    index = build_search_index(output)
+    assert [e['title'] for e in index['events']] == ['Skialpový kurz - Jeseníky', 'KURZ LEZENÍ NA UMĚLÉ STĚNĚ', 'Výprava bez odkazu']
+    assert index['events'][2]['url'] is None
+    assert index['tokens']['vyprava'] == [2]
+    assert index['events'][0]['end_date'] == '2024-03-03'
+    assert index['tokens']['kurz'] == [0, 1]
+    assert index['tokens']['lezeni'] == [1]
+    assert index['tokens']['skialp'] == [0]
+    assert index['tokens']['jeseniky'] == [0]
+    assert index['prefixes']['le'] == [1]
+    assert index['prefixes']['skialp'] == [0]
+    assert 'na' in index['tokens'] and 'na' not in index['prefixes']
+    assert 'eshop' not in index['tokens']
+
+
+def test_diff_events():
+    kurz = {'title': 'Kurz', 'url': 'https://example.com/kurz/', 'start_date': '2024-03-02', 'end_date': '2024-03-03', 'duration_days': 2}
+    past = {'title': 'Výlet', 'url': 'https://example.com/vylet/', 'start_date': '2024-02-10', 'end_date': '2024-02-10'}
+    cancelled = {'title': 'Výlet', 'url': 'https://example.com/vylet/', 'start_date': '2024-03-10', 'end_date': '2024-03-10'}
+    new = {'title': 'Nový kurz', 'url': 'https://example.com/novy/', 'start_date': '2024-04-01', 'end_date': '2024-04-01'}
+    longer = {**kurz, 'end_date': '2024-03-04', 'duration_days': 3}
+    unlinked = {'title': 'Kurz', 'url': None, 'start_date': '2024-03-02', 'end_date': '2024-03-02'}
+    assert diff_events([past, kurz], [kurz], '2024-03-01') == {'added': [], 'removed': [], 'changed': []}
+    assert diff_events([kurz], [{**kurz, 'stale': True}], '2024-03-01') == {'added': [], 'removed': [], 'changed': []}
+    kurz_dates = {**kurz, 'start_date': date(2024, 3, 2), 'end_date': date(2024, 3, 3)}
+    assert diff_events([kurz], [kurz_dates], '2024-03-01') == {'added': [], 'removed': [], 'changed': []}
+    assert diff_events([kurz], [kurz, unlinked], '2024-03-01') == {'added': [unlinked], 'removed': [], 'changed': []}
+    assert diff_events([past, kurz, cancelled], [longer, new], '2024-03-01') == {
+        'added': [new],
+        'removed': [cancelled],
+        'changed': [{
+            'title': 'Kurz', 'url': 'https://example.com/kurz/', 'start_date': '2024-03-02',
+            'before': {'end_date': '2024-03-03', 'duration_days': 2},
+            'after': {'end_date': '2024-03-04', 'duration_days': 3},
+        }],
+    }
+
+
+def test_write_outputs_rewrites_stale_markers(tmp_path):
+    output_path = tmp_path / 'calendar.json'
+    changes_path = tmp_path / 'changes.ndjson'
+    args = Namespace(
+        output=str(output_path), format='nested', write_unchanged=False, compress=False,
+        split_dir=None, layout=None, search_index=None, changes=str(changes_path))
+    kurz = {'title': 'Kurz', 'url': 'https://example.com/kurz/', 'start_date': date(2024, 3, 2), 'end_date': date(2024, 3, 2)}
+
+    def output(**marker):
+        return {'months': [{'date': date(2024, 3, 1), **marker, 'days': [{'date': date(2024, 3, 2), 'events': [{**kurz, **marker}]}]}]}
+
+    write_outputs(output(stale=True), args)
+    write_outputs(output(), args)
+    assert 'stale' not in output_path.read_text()
+    assert not changes_path.exists()
+
+
+class FakeResponse:
+    '''
+    Response returned by FakeSession in the tests.
+    '''
+
+    def __init__(self, status_code, headers=None, text=''):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'HTTP {self.status_code}', response=self)
+
+
+class FakeSession:
+    '''
+    Stand-in for the shared session `rs` in the tests: returns (or raises) the given
+    responses in order, the last one repeatedly, and records the requests sent.
+    '''
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, headers=None, timeout=None, **kwargs):
+        self.requests.append({'method': method, 'url': url, 'headers': headers})
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def test_fetch_course_duration_coalesces_concurrent_requests(monkeypatch):
+    url = 'https://daily-adventures.cz/eshop/test-coalescing/'
+    calls = []
+    started = Event()
+    release = Event()
+
+    def fake_download(url):
+        calls.append(url)
+        started.set()
+        release.wait(5)
+        return 2
+
+    monkeypatch.setattr(sys.modules[__name__], '_download_course_duration', fake_download)
+    monkeypatch.setattr(sys.modules[__name__], '_course_duration_cache', {})
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        first = executor.submit(fetch_course_duration, url)
+        started.wait(5)
+        others = [executor.submit(fetch_course_duration, url) for _ in range(3)]
+        release.set()
+        assert [f.result() for f in [first, *others]] == [2, 2, 2, 2]
+    assert calls == [url]
+    assert fetch_course_duration(url) == 2
+    assert calls == [url]
+
+
+def test_course_cache_revalidates_stale_entries(monkeypatch):
+    url = 'https://daily-adventures.cz/eshop/test-cache/'
+    fresh = datetime.now(timezone.utc).isoformat()
+    stale = (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()
+    session = FakeSession(FakeResponse(304))
+    monkeypatch.setattr(sys.modules[__name__], 'rs', session)
+    monkeypatch.setattr(sys.modules[__name__], '_course_cache_entries', {})
+    _course_cache_entries[url] = {'days': 2, 'etag': '"abc"', 'last_modified': None, 'fetched_at': fresh}
+    assert _download_course_duration(url) == 2
+    assert session.requests == []
+    _course_cache_entries[url]['fetched_at'] = stale
+    assert _download_course_duration(url) == 2
+    assert [r['headers'] for r in session.requests] == [{'If-None-Match': '"abc"'}]
+    assert _course_cache_entries[url]['fetched_at'] != stale
+
+
+def test_send_request_retries_transient_failures(monkeypatch):
+    module = sys.modules[__name__]
+    url = 'https://daily-adventures.cz/eshop/test-retry/'
+    monkeypatch.setattr(module, 'RETRY_BACKOFF_BASE', 0)
+    monkeypatch.setattr(module, '_course_duration_cache', {})
+    monkeypatch.setattr(module, '_course_duration_failed', set())
+    monkeypatch.setattr(module, '_course_cache_entries', {})
+    session = FakeSession(FakeResponse(503, {'Retry-After': '0'}), requests.ConnectionError('reset'), FakeResponse(200))
+    monkeypatch.setattr(module, 'rs', session)
+    assert send_request('GET', url, headers={}, timeout=10).status_code == 200
+    assert len(session.requests) == 3
+    # a transient failure after all retries is not stored in the course cache
+    monkeypatch.setattr(module, 'rs', FakeSession(FakeResponse(502, {'Retry-After': '0'})))
+    assert fetch_course_duration(url) is None
+    assert url not in _course_duration_cache
+    assert url not in _course_cache_entries
+
+
+def test_failed_course_page_is_fetched_once_per_run(monkeypatch):
+    module = sys.modules[__name__]
+    url = 'https://daily-adventures.cz/eshop/test-retry/'
+    monkeypatch.setattr(module, 'RETRY_BACKOFF_BASE', 0)
+    monkeypatch.setattr(module, '_course_duration_cache', {})
+    monkeypatch.setattr(module, '_course_duration_failed', set())
+    monkeypatch.setattr(module, '_course_cache_entries', {})
+    session = FakeSession(FakeResponse(503, {'Retry-After': '0'}))
+    monkeypatch.setattr(module, 'rs', session)
+    days = [{'date': date(2024, 3, 1), 'events': [{'title': 'Kurz', 'url': url}]}]
+    # prefetched first, then looked up again by consolidate_multiday_events()
+    months = list(consolidate_months([(date(2024, 3, 1), days)]))
+    assert months[0]['days'][0]['events'] == [
+        {'title': 'Kurz', 'url': url, 'start_date': date(2024, 3, 1), 'end_date': date(2024, 3, 1)}]
+    assert len(session.requests) == _max_retries + 1
+    assert url not in _course_cache_entries
+
+
+def test_serve_calendar_files():
+    assert [refresh_interval(i, 300) for i in range(5)] == [300, 300, 600, 1200, 2400]
+    assert refresh_interval(12, 300) == REFRESH_INTERVAL_MAX
+    service = CalendarService({}, 300)
+    service.publish({'months': [{'date': '2024-03-01', 'days': [{'date': '2024-03-01', 'events': [
+        {'title': 'Kurz', 'url': 'https://example.com/kurz/', 'start_date': '2024-03-01', 'end_date': '2024-03-01'},
+    ]}]}]})
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), CalendarRequestHandler)
+    httpd.service = service
+    Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{httpd.server_address[1]}'
+    try:
+        r = requests.get(f'{base_url}/calendar.json', headers={'Accept-Encoding': 'gzip'})
+        assert r.status_code == 200
+        assert r.headers['Content-Encoding'] == 'gzip'
+        assert r.json()['months'][0]['date'] == '2024-03-01'
+        r2 = requests.get(f'{base_url}/calendar.json', headers={'If-None-Match': r.headers['ETag']})
+        assert r2.status_code == 304
+        r = requests.get(f'{base_url}/months/2024-03.json', headers={'Accept-Encoding': 'identity'})
+        assert 'Content-Encoding' not in r.headers
+        assert r.json()['events'][0]['title'] == 'Kurz'
+        assert requests.get(f'{base_url}/months/manifest.json').json()['months'][0]['file'] == '2024-03.json'
+        assert requests.get(f'{base_url}/nothing.json').status_code == 404
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_deadline_falls_back_to_previous_months(monkeypatch):
+    monkeypatch.setattr(sys.modules[__name__], '_deadline', None)
+    previous_march = {'date': '2024-03-01', 'days': [{'date': '2024-03-01', 'events': [
+        {'title': 'Kurz', 'url': 'https://example.com/kurz/', 'start_date': '2024-03-01', 'end_date': '2024-03-02', 'duration_days': 2},
+    ]}]}
+    set_deadline(0)
+    months = list(iter_calendar_months(
+        [date(2024, 3, 1), date(2024, 4, 1)], jobs=2, fallback_months={'2024-03-01': previous_march}))
+    assert months == [{'date': date(2024, 3, 1), 'stale': True, 'days': [{'date': date(2024, 3, 1), 'events': [
+        {'title': 'Kurz', 'url': 'https://example.com/kurz/', 'start_date': date(2024, 3, 1), 'end_date': date(2024, 3, 2), 'duration_days': 2, 'stale': True},
+    ]}]}]
+
+
+def test_month_cache_key_includes_parser_version_and_host(tmp_path, monkeypatch):
+    module = sys.modules[__name__]
+    month_html = decompress(b64decode(sample_response.strip())).decode('utf-8')
+    month_cache_path = tmp_path / 'month_cache.json'
+    parsed = []
+    original_parse_month_days = parse_month_days
+
+    def counting_parse_month_days(data, month_date, preferred_host='daily-adventures.cz'):
+        parsed.append(preferred_host)
+        return original_parse_month_days(data, month_date, preferred_host=preferred_host)
+
+    monkeypatch.setattr(module, '_course_duration_cache', dict.fromkeys([
+        'https://daily-adventures.cz/eshop/lavinovy-kurz-pro-zacatecniky-jeseniky/',
+        'https://daily-adventures.cz/eshop/skialpovy-kurz-pro-zacatecniky-jeseniky/',
+        'https://daily-adventures.cz/eshop/zakladni-kurz-lezeni-na-umele-stene/',
+    ]))
+    monkeypatch.setattr(module, 'parse_month_days', counting_parse_month_days)
+
+    def build(sources=(DEFAULT_SOURCE,)):
+        return build_calendar([date(2024, 3, 1)], sources=sources, month_htmls=[[month_html]], month_cache_path=month_cache_path)
+
+    first = build()
+    assert build() == first
+    assert len(parsed) == 1
+    monkeypatch.setattr(module, 'MONTH_PARSER_VERSION', MONTH_PARSER_VERSION + 1)
+    build()
+    assert len(parsed) == 2
+    build([{**DEFAULT_SOURCE, 'base_url': 'https://www.daily-adventures.cz'}])
+    assert parsed[-1] == 'www.daily-adventures.cz'
+
+
+def test_build_calendar_prefetches_all_months_at_once(monkeypatch):
+    module = sys.modules[__name__]
+    month_html = decompress(b64decode(sample_response.strip())).decode('utf-8')
+    prefetched = []
+    monkeypatch.setattr(module, 'prefetch_course_durations', lambda urls, jobs=8, per_host=4: prefetched.append(urls))
+    monkeypatch.setattr(module, '_course_duration_cache', {})
+    monkeypatch.setattr(module, 'fetch_course_duration', lambda url: None)
+    # Consolidate each month on its own
+    monkeypatch.setattr(module, 'events_continue', lambda previous_days, days: False)
+    # The sample HTML lists a 31-day month
+    month_dates = [date(2024, 1, 1), date(2024, 3, 1)]
+    output = build_calendar(month_dates, month_htmls=[[month_html], [month_html]])
+    assert [month['date'] for month in output['months']] == month_dates
+    assert len(prefetched) == 1
+    assert len(prefetched[0]) == 3
+    assert output['months'] == list(iter_calendar_months(month_dates, month_htmls=[[month_html], [month_html]]))
+    assert len(prefetched) == 1 + 2
+
+
+def test_deadline_consolidates_cached_days_of_missing_months(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys.modules[__name__], '_deadline', None)
+    kurz = {'title': 'Kurz', 'url': 'https://example.com/kurz/'}
+    month_cache_path = tmp_path / 'month_cache.json'
+    save_month_cache(month_cache_path, {
+        'daily-adventures:2024-03-01': {'hash': 'x', 'days': [{'date': '2024-03-31', 'events': [kurz]}]},
+        'daily-adventures:2024-04-01': {'hash': 'y', 'days': [{'date': '2024-04-01', 'events': [kurz]}, {'date': '2024-04-02', 'events': []}]},
+    })
+    set_deadline(0)
+    months = list(iter_calendar_months(
+        [date(2024, 3, 1), date(2024, 4, 1)], month_cache_path=month_cache_path, fallback_months={}))
+    assert [month.get('stale') for month in months] == [True, True]
+    assert months[0]['days'][0]['events'] == [
+        {**kurz, 'start_date': date(2024, 3, 31), 'end_date': date(2024, 4, 1), 'duration_days': 2, 'stale': True}]
+    assert months[1]['days'][0]['events'] == []
+
+
 if __name__ == '__main__':
-    test_parse_month_html()
     main()